@@ -0,0 +1,134 @@
+"""On-disk cache of raw model answers, keyed by (model, temperature, prompt).
+
+Only the answer text is stored — parsing it again is cheap, and the parsed
+Action holds live page elements that can't outlive the page anyway.
+
+A second, looser key (see make_question_key) lets near-duplicate questions
+that differ only in case or spacing share an answer. For
+multiple-choice questions, get_variant/put_variant go one step further and
+match the question regardless of choice order.
+"""
+from __future__ import annotations
+import os
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+
+import config
+
+logger = logging.getLogger(__name__)
+
+_conn: sqlite3.Connection | None = None
+_lock = threading.Lock()
+
+
+def _get_conn() -> sqlite3.Connection:
+    global _conn
+    if _conn is None:
+        path = os.path.join(config._get_app_dir(), config.ANSWER_CACHE_FILE)
+        _conn = sqlite3.connect(path, check_same_thread=False)
+        # WAL: reads don't block on a concurrent write from the batch paths
+        _conn.execute("PRAGMA journal_mode=WAL")
+        _conn.execute(
+            "CREATE TABLE IF NOT EXISTS answers ("
+            "key TEXT PRIMARY KEY, answer TEXT NOT NULL, expires REAL NOT NULL)"
+        )
+        # Expired rows are never served; drop them once per run so the file
+        # doesn't grow without bound
+        _conn.execute("DELETE FROM answers WHERE expires <= ?", (time.time(),))
+        _conn.commit()
+    return _conn
+
+
+def make_key(model: str, temperature: float, prompt: str) -> str:
+    return hashlib.blake2b(f"{model}|{temperature}|{prompt}".encode(),
+                           digest_size=16).hexdigest()
+
+
+def _normalize(text: str) -> str:
+    # Case and whitespace only: punctuation and symbols carry meaning
+    # ("x + 3" vs "x - 3", "5" vs "-5"), so they stay in the key
+    return " ".join(text.lower().split())
+
+
+def make_question_key(model: str, qd) -> str:
+    """Key on the normalized question and its options rather than the prompt.
+
+    Options stay in page order with their labels, so a hit can only return an
+    answer whose letters still line up with this question's. Text the model
+    echoes back verbatim (dropdown options, ordering/matching items) is kept
+    exact.
+    """
+    options = [f"{c.get('label', '')}={_normalize(c.get('text', ''))}="
+               + "\x1f".join(c.get("options", [])) for c in qd.choices]
+    lists = [qd.items, qd.sources, qd.targets]
+    raw = "|".join([
+        "q", model, qd.type, str(qd.blank_count), _normalize(qd.question),
+        *options, *("\x1f".join(lst) for lst in lists),
+    ])
+    return hashlib.blake2b(raw.encode(), digest_size=16).hexdigest()
+
+
+def get(key: str) -> str | None:
+    """Return the cached answer for key, or None if missing/expired/unreadable."""
+    try:
+        with _lock:
+            row = _get_conn().execute(
+                "SELECT answer FROM answers WHERE key = ? AND expires > ?",
+                (key, time.time())).fetchone()
+    except sqlite3.Error as e:
+        logger.warning(f"Answer cache read failed: {e}")
+        return None
+    return row[0] if row else None
+
+
+def put(key: str, answer: str) -> None:
+    try:
+        with _lock:
+            conn = _get_conn()
+            conn.execute(
+                "INSERT OR REPLACE INTO answers (key, answer, expires) VALUES (?, ?, ?)",
+                (key, answer, time.time() + config.ANSWER_CACHE_TTL))
+            conn.commit()
+    except sqlite3.Error as e:
+        logger.warning(f"Answer cache write failed: {e}")
+
+
+def _variant_key(model: str, qd) -> str | None:
+    """Key on the question and its *set* of choice texts, or None if the
+    question isn't multiple-choice or two choices normalize the same."""
+    if qd.type not in ("mc_single", "mc_multi") or not qd.choices:
+        return None
+    texts = sorted(_normalize(c.get("text", "")) for c in qd.choices)
+    if len(set(texts)) != len(texts):
+        return None
+    raw = "|".join(["v", model, qd.type, _normalize(qd.question), *texts])
+    return hashlib.blake2b(raw.encode(), digest_size=16).hexdigest()
+
+
+def put_variant(model: str, qd, letters: list[str]) -> None:
+    """Remember the chosen options by text so a reshuffled copy can reuse them."""
+    key = _variant_key(model, qd)
+    if key is None:
+        return
+    by_label = {c.get("label", "").upper(): c for c in qd.choices}
+    chosen = [by_label.get(letter.upper()) for letter in letters]
+    if not chosen or None in chosen:
+        return
+    put(key, "\x1f".join(_normalize(c.get("text", "")) for c in chosen))
+
+
+def get_variant(model: str, qd) -> str | None:
+    """Return an "ANSWER: ..." reply with the stored options mapped to this
+    question's current letters, or None."""
+    key = _variant_key(model, qd)
+    stored = get(key) if key else None
+    if stored is None:
+        return None
+    by_text = {_normalize(c.get("text", "")): c.get("label", "") for c in qd.choices}
+    labels = [by_text.get(text) for text in stored.split("\x1f")]
+    if None in labels:
+        return None
+    return "ANSWER: " + ", ".join(labels)
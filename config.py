@@ -9,6 +9,8 @@ APP_VERSION = "1.1.1"
 
 # GitHub repo for update checks
 GITHUB_REPO = "FanexLLC/Mcgraw-Solver"
+UPDATE_CACHE_FILE = "update_check.json"
+UPDATE_CHECK_INTERVAL = 3600  # seconds between GitHub requests
 
 
 def _get_app_dir():
@@ -44,6 +46,21 @@ ACCESS_KEY = os.getenv("ACCESS_KEY", "")
 GPT_MODEL = "claude-sonnet-4-5-20250929"
 GPT_TEMPERATURE = 0.0
 
+# Local cache of model answers (only used when GPT_TEMPERATURE == 0)
+ENABLE_ANSWER_CACHE = True
+ANSWER_CACHE_FILE = "answer_cache.sqlite3"
+ANSWER_CACHE_TTL = 7 * 86400  # seconds
+# Also reuse multiple-choice answers when the same question comes back with
+# its choices shuffled (the answer is stored by choice text, not letter)
+ENABLE_GENCACHE = False
+
+# Answer from the textbook passage without a model call when a choice or the
+# blank's sentence appears in it verbatim (heuristic; can be wrong)
+ENABLE_DIRECT_HEURISTICS = False
+
+# Max questions in flight at once for solver.solve_batch
+MAX_CONCURRENCY = 8
+
 # Timing (seconds) - human-like delays
 MIN_DELAY = 2.0
 MAX_DELAY = 5.0
@@ -0,0 +1,57 @@
+"""Answer questions locally when no model call is needed.
+
+try_direct returns a reply in the same "ANSWER: ..." form the model would
+send, so solver parses it like any other response. Questions with only one
+possible answer are always resolved here; the textbook-matching rules below
+are guesses and only run with config.ENABLE_DIRECT_HEURISTICS.
+"""
+from __future__ import annotations
+import re
+
+import config
+from models import QuestionData
+
+_BLANK_RE = re.compile(r"_{2,}|\[blank\]", re.IGNORECASE)
+_MIN_CHOICE_MATCH = 20  # shorter choice texts show up in passages by chance
+_CLOZE_WORDS = 4  # words either side of the blank to look for in the passage
+
+
+def try_direct(qd: QuestionData) -> str | None:
+    """Return an "ANSWER: ..." reply for qd, or None if the model is needed."""
+    if qd.type == "mc_single" and len(qd.choices) == 1:
+        return f"ANSWER: {qd.choices[0]['label']}"
+    if qd.type == "dropdown" and qd.choices and all(
+            len(c.get("options", [])) == 1 for c in qd.choices):
+        return "ANSWER: " + "; ".join(
+            f"{i + 1}: {c['options'][0]}" for i, c in enumerate(qd.choices))
+
+    if not config.ENABLE_DIRECT_HEURISTICS or not qd.context:
+        return None
+    if qd.type == "mc_single":
+        return _choice_in_context(qd)
+    if qd.type == "fill" and qd.blank_count == 1:
+        return _cloze_from_context(qd)
+    return None
+
+
+def _choice_in_context(qd: QuestionData) -> str | None:
+    """Pick the one long choice the passage quotes verbatim."""
+    context = qd.context.lower()
+    found = [c for c in qd.choices
+             if len(c["text"]) > _MIN_CHOICE_MATCH and c["text"].lower() in context]
+    return f"ANSWER: {found[0]['label']}" if len(found) == 1 else None
+
+
+def _cloze_from_context(qd: QuestionData) -> str | None:
+    """Fill the blank when the question sentence is lifted from the passage."""
+    pieces = _BLANK_RE.split(qd.question)
+    if len(pieces) != 2:
+        return None
+    before = pieces[0].split()[-_CLOZE_WORDS:]
+    after = pieces[1].strip(" .?!").split()[:_CLOZE_WORDS]
+    if not before:  # the match needs a left anchor
+        return None
+    pattern = (r"\s+".join(map(re.escape, before)) + r"\s+(.{1,60}?)"
+               + (r"\s+" + r"\s+".join(map(re.escape, after)) if after else r"[.;,]"))
+    matches = re.findall(pattern, qd.context, re.IGNORECASE)
+    return f"ANSWER: {matches[0].strip()}" if len(set(matches)) == 1 else None
@@ -4,7 +4,6 @@ import logging
 import sys
 import uuid
 import threading
-import requests
 from typing import Any
 from datetime import datetime
 
@@ -71,7 +70,7 @@ class SolverApp:
             # Start session
             try:
                 self.session_id = str(uuid.uuid4())
-                response = requests.post(
+                response = solver.http_session().post(
                     f"{config.SERVER_URL}/api/session/start",
                     json={
                         "access_key": settings["access_key"],
@@ -128,7 +127,7 @@ class SolverApp:
         # End session
         if self.session_id:
             try:
-                requests.post(
+                solver.http_session().post(
                     f"{config.SERVER_URL}/api/session/end",
                     json={"session_id": self.session_id},
                     timeout=5
@@ -146,7 +145,7 @@ class SolverApp:
         def heartbeat_loop():
             while not self.stop_flag and self.session_id:
                 try:
-                    requests.post(
+                    solver.http_session().post(
                         f"{config.SERVER_URL}/api/session/heartbeat",
                         json={"session_id": self.session_id},
                         timeout=5
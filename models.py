@@ -1,9 +1,13 @@
 from __future__ import annotations
+import sys
 from dataclasses import dataclass, field
 from typing import Any
 
+# Slotted instances (Python 3.10+): faster attribute access, no per-instance dict
+_SLOTS = {"slots": True} if sys.version_info >= (3, 10) else {}
 
-@dataclass
+
+@dataclass(**_SLOTS)
 class QuestionData:
     type: str = "unknown"
     question: str = ""
@@ -19,7 +23,7 @@ class QuestionData:
     target_elements: list[Any] = field(default_factory=list)
 
 
-@dataclass
+@dataclass(**_SLOTS)
 class Action:
     type: str
     answer_text: str = ""
@@ -3,10 +3,12 @@
 from __future__ import annotations
 import os
 import re
+import json
 import time
 import logging
 import secrets
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from functools import wraps
 
@@ -34,6 +36,8 @@ logger = logging.getLogger(__name__)
 
 RATE_LIMIT = int(os.environ.get("RATE_LIMIT", "120"))
 RATE_WINDOW = 3600
+# Upper bound on output tokens per solve; clients may ask for less
+MAX_OUTPUT_TOKENS = 1024
 
 _rate_tracker: dict[str, list[float]] = defaultdict(list)
 
@@ -48,6 +52,10 @@ ANTHROPIC_API_KEY = os.environ.get("ANTHROPIC_API_KEY", "")
 ADMIN_PASSWORD = os.environ.get("ADMIN_PASSWORD", "")
 JWT_SECRET = os.environ.get("JWT_SECRET", "")
 
+# Shared by /api/solve and /api/solve/many. Far below Anthropic's 1024-token
+# minimum cacheable prefix, so it is sent without cache_control.
+SYSTEM_PROMPT = "You are a knowledgeable academic assistant. Answer precisely and concisely."
+
 CLAUDE_MODELS = {"claude-sonnet-4-5-20250929", "claude-haiku-4-5-20251001",
                  "claude-sonnet-4-5", "claude-haiku-4-5"}
 
@@ -159,6 +167,140 @@ def _check_key_expiry(key_entry: dict) -> str | None:
     return None
 
 
+def _check_session_expiry(key_entry: dict, session_start_time: str | None) -> str | None:
+    """Like _check_key_expiry, but a session started before expiry gets a
+    5-hour grace period."""
+    expires_val = key_entry.get("expires")
+    if not expires_val:
+        return None
+    if isinstance(expires_val, str):
+        expiry = datetime.fromisoformat(expires_val.rstrip("Z"))
+    else:
+        expiry = expires_val
+
+    now = datetime.utcnow()
+
+    # If session_start_time is provided, check for grace period
+    if session_start_time:
+        try:
+            session_start = datetime.fromisoformat(session_start_time.rstrip("Z"))
+
+            # Session started before expiry - allow 5-hour grace period
+            if session_start < expiry:
+                grace_period_hours = 5
+                grace_expiry = expiry + timedelta(hours=grace_period_hours)
+                if now > grace_expiry:
+                    return "Grace period expired. Please purchase a new plan."
+            # Session started after expiry - no grace period
+            elif now > expiry:
+                return "Access key expired. Please renew your subscription."
+        except (ValueError, AttributeError):
+            # Invalid session_start_time format - fall back to regular expiry check
+            if now > expiry:
+                return "Access key expired. Please renew your subscription."
+    # No session_start_time - regular expiry check
+    elif now > expiry:
+        return "Access key expired. Please renew your subscription."
+    return None
+
+
+def _clamp_max_tokens(value) -> int:
+    """Client-requested output cap, limited to MAX_OUTPUT_TOKENS."""
+    try:
+        return max(1, min(int(value or MAX_OUTPUT_TOKENS), MAX_OUTPUT_TOKENS))
+    except (TypeError, ValueError):
+        return MAX_OUTPUT_TOKENS
+
+
+def _consume_rate_limit(access_key: str, n: int = 1) -> bool:
+    """Count n model calls against the key's hourly limit.
+
+    Returns False, counting nothing, if they don't all fit in the window.
+    """
+    now = time.time()
+    window_start = now - RATE_WINDOW
+    _rate_tracker[access_key] = [t for t in _rate_tracker[access_key] if t > window_start]
+    if len(_rate_tracker[access_key]) + n > RATE_LIMIT:
+        logger.warning(f"Rate limit hit for key={access_key[:8]}... ({n} prompts)")
+        return False
+    _rate_tracker[access_key].extend([now] * n)
+    return True
+
+
+def _resolve_model(data: dict, key_entry: dict):
+    """Pick the model for a request and check the key's plan allows it.
+
+    Uses the requested model, else the key's preference, else the plan
+    default. Returns (model, None), or (model, error response) if the plan
+    doesn't include it.
+    """
+    user_plan = key_entry.get("plan", "monthly")
+    model = (data.get("model") or key_entry.get("preferred_model")
+             or get_default_model_for_plan(user_plan))
+    if is_model_allowed_for_plan(model, user_plan):
+        return model, None
+    logger.warning(f"Model {model} not allowed for plan {user_plan}")
+    return model, (jsonify({
+        "error": f"Model '{MODEL_DISPLAY_NAMES.get(model, model)}' not available on {user_plan.capitalize()} plan. Please upgrade or select an allowed model.",
+        "allowed_models": PLAN_MODEL_ACCESS.get(user_plan, [])
+    }), 403)
+
+
+# A finished "ANSWER: ..." line (non-empty, newline-terminated). A bare
+# "ANSWER:" header, as ordering answers use, doesn't count.
+_ANSWER_DONE_RE = re.compile(r'^ANSWER:[ \t]*\S.*\n', re.IGNORECASE | re.MULTILINE)
+
+
+def _collect_text(text_chunks, stop_at_answer: bool) -> str:
+    """Join streamed text. With stop_at_answer, stop once a complete ANSWER
+    line has arrived; only for replies whose answer is that single line
+    (ordering/matching answers span several lines after the header)."""
+    buf: list[str] = []
+    for piece in text_chunks:
+        buf.append(piece)
+        if stop_at_answer and "\n" in piece and _ANSWER_DONE_RE.search("".join(buf)):
+            break
+    return "".join(buf).strip()
+
+
+def _complete(model: str, prompt: str, temperature: float, max_tokens: int,
+              stop_at_answer: bool = False) -> str:
+    """Run one prompt through the provider and return the answer text.
+
+    Streams so that, when the client asks for stop_at_answer, we can stop as
+    soon as the ANSWER line is complete instead of waiting for anything the
+    model writes after it.
+    """
+    if model in CLAUDE_MODELS:
+        ac = get_anthropic_client()
+        with ac.messages.stream(
+            model=model,
+            max_tokens=max_tokens,
+            temperature=temperature,
+            system=SYSTEM_PROMPT,
+            messages=[{"role": "user", "content": prompt}],
+        ) as stream:
+            return _collect_text(stream.text_stream, stop_at_answer)
+
+    oai = get_openai_client()
+    stream = oai.chat.completions.create(
+        model=model,
+        temperature=temperature,
+        max_tokens=max_tokens,
+        messages=[
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": prompt},
+        ],
+        stream=True,
+    )
+    try:
+        return _collect_text(
+            (chunk.choices[0].delta.content or ""
+             for chunk in stream if chunk.choices), stop_at_answer)
+    finally:
+        stream.close()
+
+
 # ── Endpoints ─────────────────────────────────────────────────────
 
 @app.route("/api/solve", methods=["POST"])
@@ -175,95 +317,30 @@ def solve():
         return jsonify({"error": "Invalid access key"}), 403
 
     # Grace period logic for active sessions
-    expires_val = key_entry.get("expires")
-    if expires_val:
-        if isinstance(expires_val, str):
-            expiry = datetime.fromisoformat(expires_val.rstrip("Z"))
-        else:
-            expiry = expires_val
-
-        now = datetime.utcnow()
-
-        # If session_start_time is provided, check for grace period
-        if session_start_time:
-            try:
-                session_start = datetime.fromisoformat(session_start_time.rstrip("Z"))
-
-                # Session started before expiry - allow 5-hour grace period
-                if session_start < expiry:
-                    grace_period_hours = 5
-                    grace_expiry = expiry + timedelta(hours=grace_period_hours)
-                    if now > grace_expiry:
-                        return jsonify({"error": "Grace period expired. Please purchase a new plan."}), 403
-                # Session started after expiry - no grace period
-                elif now > expiry:
-                    return jsonify({"error": "Access key expired. Please renew your subscription."}), 403
-            except (ValueError, AttributeError):
-                # Invalid session_start_time format - fall back to regular expiry check
-                if now > expiry:
-                    return jsonify({"error": "Access key expired. Please renew your subscription."}), 403
-        else:
-            # No session_start_time - regular expiry check
-            if now > expiry:
-                return jsonify({"error": "Access key expired. Please renew your subscription."}), 403
-
-    # Rate limiting
-    now = time.time()
-    window_start = now - RATE_WINDOW
-    _rate_tracker[access_key] = [t for t in _rate_tracker[access_key] if t > window_start]
-    if len(_rate_tracker[access_key]) >= RATE_LIMIT:
-        logger.warning(f"Rate limit hit for key={access_key[:8]}...")
-        return jsonify({"error": "Rate limit exceeded. Try again later."}), 429
-    _rate_tracker[access_key].append(now)
-
-    update_key_usage(access_key)
+    expiry_error = _check_session_expiry(key_entry, session_start_time)
+    if expiry_error:
+        return jsonify({"error": expiry_error}), 403
 
     prompt = data.get("prompt", "")
-    model = data.get("model")
     temperature = data.get("temperature", 0.0)
+    max_tokens = _clamp_max_tokens(data.get("max_tokens"))
+    stop_at_answer = bool(data.get("stop_at_answer"))
 
     if not prompt:
         return jsonify({"error": "No prompt provided"}), 400
 
     # AI Model Tier Enforcement
-    user_plan = key_entry.get("plan", "monthly")
+    model, denied = _resolve_model(data, key_entry)
+    if denied:
+        return denied
 
-    # If no model specified, use user's preference or plan default
-    if not model:
-        model = key_entry.get("preferred_model") or get_default_model_for_plan(user_plan)
+    if not _consume_rate_limit(access_key):
+        return jsonify({"error": "Rate limit exceeded. Try again later."}), 429
 
-    # Check if model is allowed for user's plan
-    if not is_model_allowed_for_plan(model, user_plan):
-        allowed_models = PLAN_MODEL_ACCESS.get(user_plan, [])
-        logger.warning(f"Model {model} not allowed for plan {user_plan}")
-        return jsonify({
-            "error": f"Model '{MODEL_DISPLAY_NAMES.get(model, model)}' not available on {user_plan.capitalize()} plan. Please upgrade or select an allowed model.",
-            "allowed_models": allowed_models
-        }), 403
+    update_key_usage(access_key)
 
-    system_msg = "You are a knowledgeable academic assistant. Answer precisely and concisely."
     try:
-        if model in CLAUDE_MODELS:
-            ac = get_anthropic_client()
-            response = ac.messages.create(
-                model=model,
-                max_tokens=1024,
-                temperature=temperature,
-                system=system_msg,
-                messages=[{"role": "user", "content": prompt}],
-            )
-            answer = response.content[0].text.strip()
-        else:
-            oai = get_openai_client()
-            response = oai.chat.completions.create(
-                model=model,
-                temperature=temperature,
-                messages=[
-                    {"role": "system", "content": system_msg},
-                    {"role": "user", "content": prompt},
-                ],
-            )
-            answer = response.choices[0].message.content.strip()
+        answer = _complete(model, prompt, temperature, max_tokens, stop_at_answer)
 
         logger.info(f"Key={access_key[:8]}... | Model={model} | Answer={answer[:50]}")
         return jsonify({"answer": answer})
@@ -273,6 +350,186 @@ def solve():
         return jsonify({"error": str(e)}), 500
 
 
+# ── Multi Solve (several prompts per request) ─────────────────────
+
+# One thread per prompt, so a request takes about as long as its slowest
+# model call and stays well inside the gunicorn worker timeout (Procfile)
+MULTI_MAX_PROMPTS = 8
+MULTI_WORKERS = MULTI_MAX_PROMPTS
+
+
+@app.route("/api/solve/many", methods=["POST"])
+def solve_many():
+    """Answer several prompts in one request, calling the model in parallel.
+
+    Body is /api/solve's with "prompts" (and optionally a parallel
+    "max_tokens" list) instead of "prompt". Returns {"answers": [...]} in
+    prompt order; a prompt whose model call failed gets null.
+    """
+    data = request.get_json()
+    if not data:
+        return jsonify({"error": "No JSON body"}), 400
+
+    access_key = data.get("access_key", "")
+    key_entry = find_key(access_key)
+    if not key_entry:
+        return jsonify({"error": "Invalid access key"}), 403
+
+    expiry_error = _check_session_expiry(key_entry, data.get("session_start_time"))
+    if expiry_error:
+        return jsonify({"error": expiry_error}), 403
+
+    prompts = data.get("prompts") or []
+    if not prompts or not all(isinstance(p, str) and p for p in prompts):
+        return jsonify({"error": "prompts must be a non-empty list of strings"}), 400
+    if len(prompts) > MULTI_MAX_PROMPTS:
+        return jsonify({"error": f"At most {MULTI_MAX_PROMPTS} prompts per request"}), 400
+
+    model, denied = _resolve_model(data, key_entry)
+    if denied:
+        return denied
+
+    # Each prompt counts against the hourly rate limit
+    if not _consume_rate_limit(access_key, len(prompts)):
+        return jsonify({"error": "Rate limit exceeded. Try again later."}), 429
+
+    update_key_usage(access_key)
+
+    temperature = data.get("temperature", 0.0)
+    caps = data.get("max_tokens")
+    if not isinstance(caps, list) or len(caps) != len(prompts):
+        caps = [caps] * len(prompts)
+    stops = data.get("stop_at_answer")
+    if not isinstance(stops, list) or len(stops) != len(prompts):
+        stops = [stops] * len(prompts)
+
+    def one(prompt: str, cap, stop) -> str | None:
+        try:
+            return _complete(model, prompt, temperature, _clamp_max_tokens(cap), bool(stop))
+        except Exception as e:
+            logger.error(f"API error ({model}): {e}")
+            return None
+
+    with ThreadPoolExecutor(max_workers=min(len(prompts), MULTI_WORKERS)) as pool:
+        answers = list(pool.map(one, prompts, caps, stops))
+
+    logger.info(f"Key={access_key[:8]}... | Model={model} | Prompts={len(prompts)} "
+                f"| Failed={answers.count(None)}")
+    return jsonify({"answers": answers})
+
+
+# ── Batch Solve (OpenAI Batch API) ────────────────────────────────
+
+BATCH_MAX_PROMPTS = 500
+
+
+@app.route("/api/solve/batch", methods=["POST"])
+def solve_batch_submit():
+    """Queue many prompts as one OpenAI batch (half price, completes within 24h)."""
+    data = request.get_json()
+    if not data:
+        return jsonify({"error": "No JSON body"}), 400
+
+    access_key = data.get("access_key", "")
+    key_entry = find_key(access_key)
+    if not key_entry:
+        return jsonify({"error": "Invalid access key"}), 403
+
+    expiry_error = _check_key_expiry(key_entry)
+    if expiry_error:
+        return jsonify({"error": expiry_error}), 403
+
+    prompts = data.get("prompts") or []
+    if not prompts or not all(isinstance(p, str) and p for p in prompts):
+        return jsonify({"error": "prompts must be a non-empty list of strings"}), 400
+    if len(prompts) > BATCH_MAX_PROMPTS:
+        return jsonify({"error": f"At most {BATCH_MAX_PROMPTS} prompts per batch"}), 400
+
+    model, denied = _resolve_model(data, key_entry)
+    if denied:
+        return denied
+    if model in CLAUDE_MODELS:
+        return jsonify({"error": "Batch solving is only available for OpenAI models"}), 400
+
+    # Each prompt counts against the hourly rate limit
+    if not _consume_rate_limit(access_key, len(prompts)):
+        return jsonify({"error": "Rate limit exceeded. Try again later."}), 429
+
+    update_key_usage(access_key)
+
+    temperature = data.get("temperature", 0.0)
+    lines = [json.dumps({
+        "custom_id": str(i),
+        "method": "POST",
+        "url": "/v1/chat/completions",
+        "body": {
+            "model": model,
+            "temperature": temperature,
+            "messages": [
+                {"role": "system", "content": SYSTEM_PROMPT},
+                {"role": "user", "content": prompt},
+            ],
+        },
+    }) for i, prompt in enumerate(prompts)]
+
+    try:
+        oai = get_openai_client()
+        batch_file = oai.files.create(
+            file=("batch.jsonl", "\n".join(lines).encode()), purpose="batch")
+        batch = oai.batches.create(
+            input_file_id=batch_file.id,
+            endpoint="/v1/chat/completions",
+            completion_window="24h",
+            metadata={"key_prefix": access_key[:8]},
+        )
+    except Exception as e:
+        logger.error(f"Batch submit error: {e}")
+        return jsonify({"error": str(e)}), 500
+
+    logger.info(f"Key={access_key[:8]}... | Batch={batch.id} | Model={model} | Prompts={len(prompts)}")
+    return jsonify({"batch_id": batch.id, "status": batch.status})
+
+
+@app.route("/api/solve/batch/status", methods=["POST"])
+def solve_batch_status():
+    """Report a batch's status, with answers (by prompt index) once completed."""
+    data = request.get_json()
+    if not data:
+        return jsonify({"error": "No JSON body"}), 400
+
+    access_key = data.get("access_key", "")
+    batch_id = data.get("batch_id", "")
+    if not batch_id:
+        return jsonify({"error": "batch_id required"}), 400
+    if not find_key(access_key):
+        return jsonify({"error": "Invalid access key"}), 403
+
+    try:
+        oai = get_openai_client()
+        batch = oai.batches.retrieve(batch_id)
+        if (batch.metadata or {}).get("key_prefix") != access_key[:8]:
+            return jsonify({"error": "Batch not found"}), 404
+
+        if batch.status != "completed":
+            return jsonify({"status": batch.status})
+
+        answers: dict[str, str | None] = {}
+        if batch.output_file_id:
+            for line in oai.files.content(batch.output_file_id).text.splitlines():
+                if not line.strip():
+                    continue
+                result = json.loads(line)
+                body = (result.get("response") or {}).get("body") or {}
+                choices = body.get("choices") or []
+                answers[result["custom_id"]] = (
+                    choices[0]["message"]["content"].strip() if choices else None)
+    except Exception as e:
+        logger.error(f"Batch status error ({batch_id}): {e}")
+        return jsonify({"error": str(e)}), 500
+
+    return jsonify({"status": batch.status, "answers": answers})
+
+
 @app.route("/api/validate", methods=["POST"])
 def validate_key():
     data = request.get_json()
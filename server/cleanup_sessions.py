@@ -32,9 +32,14 @@ def cleanup_stale_sessions():
 
         # Delete sessions with no heartbeat in last 60 seconds
         timeout_seconds = 60
+        # SKIP LOCKED so sessions mid-heartbeat don't block (or get deleted by) cleanup
         cur.execute(
             """DELETE FROM active_sessions
-               WHERE last_heartbeat < NOW() - make_interval(secs => %s)
+               WHERE session_id IN (
+                   SELECT session_id FROM active_sessions
+                   WHERE last_heartbeat < NOW() - make_interval(secs => %s)
+                   FOR UPDATE SKIP LOCKED
+               )
                RETURNING access_key, session_id""",
             (timeout_seconds,)
         )
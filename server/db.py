@@ -243,12 +243,22 @@ def list_keys() -> list[dict]:
         } for k in keys_data.get("keys", [])]
 
 
+def _like_prefix(prefix: str) -> str:
+    """Escape LIKE wildcards so a key prefix only ever matches literally.
+
+    URL-safe keys can contain ``_``, which LIKE would otherwise treat as a
+    single-character wildcard.
+    """
+    escaped = prefix.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return escaped + "%"
+
+
 def revoke_key(key_prefix: str) -> int:
     """Delete keys matching prefix. Returns number deleted."""
     if _use_db:
         conn = get_db()
         cur = conn.cursor()
-        cur.execute("DELETE FROM keys WHERE key LIKE %s", (key_prefix + "%",))
+        cur.execute("DELETE FROM keys WHERE key LIKE %s", (_like_prefix(key_prefix),))
         deleted = cur.rowcount
         cur.close()
         conn.close()
@@ -263,10 +273,17 @@ def revoke_key(key_prefix: str) -> int:
 
 
 def generate_key_with_expiry(label: str, plan: str) -> tuple[str, dict]:
-    """Generate a new access key with expiration based on plan."""
-    key = secrets.token_hex(16)
+    """Generate a new access key with expiration based on plan.
+
+    Keys are 22-char URL-safe tokens (same 128 bits of entropy as the older
+    32-char hex keys, which remain valid since lookups are exact matches).
+    """
+    days = PLAN_DURATIONS.get(plan)
+    if days is None:
+        raise ValueError(f"Unknown plan '{plan}'. Choose from: {list(PLAN_DURATIONS)}")
+    key = secrets.token_urlsafe(16)
     now = datetime.utcnow()
-    expires = now + timedelta(days=PLAN_DURATIONS[plan])
+    expires = now + timedelta(days=days)
     create_key(key, label, plan, now, expires)
     return key, {"key": key, "expires": _to_iso(expires)}
 
@@ -483,6 +500,8 @@ def add_to_email_retry_queue(order_id: str, email_type: str,
             """INSERT INTO email_retry_queue (order_id, email_type, recipient, template_params, created)
                VALUES (%s, %s, %s, %s, NOW())""",
             (order_id, email_type, recipient, json.dumps(template_params)))
+        # Wake retry_emails.py --listen workers immediately
+        cur.execute("NOTIFY email_retry")
         cur.close()
         conn.close()
     else:
@@ -574,9 +593,15 @@ def cleanup_stale_sessions(timeout_seconds: int = 60) -> int:
 
     conn = get_db()
     cur = conn.cursor()
+    # SKIP LOCKED: rows currently locked by an in-flight heartbeat UPDATE are
+    # left alone rather than blocking cleanup (and are fresh anyway).
     cur.execute(
         """DELETE FROM active_sessions
-           WHERE last_heartbeat < NOW() - make_interval(secs => %s)""",
+           WHERE session_id IN (
+               SELECT session_id FROM active_sessions
+               WHERE last_heartbeat < NOW() - make_interval(secs => %s)
+               FOR UPDATE SKIP LOCKED
+           )""",
         (timeout_seconds,)
     )
     deleted = cur.rowcount
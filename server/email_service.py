@@ -27,8 +27,13 @@ PLAN_DISPLAY = {
 }
 
 
-def send_key_email(email: str, name: str, key: str, plan: str, expiry_date: str) -> bool:
-    """Send access key email to a customer."""
+def send_key_email(email: str, name: str, key: str, plan: str, expiry_date: str,
+                   session: http_requests.Session | None = None) -> bool:
+    """Send access key email to a customer.
+
+    Pass a shared ``session`` when sending a batch so the HTTPS connection
+    to EmailJS is kept alive between calls.
+    """
     try:
         parsed = datetime.fromisoformat(expiry_date.rstrip("Z"))
         expiry_date = parsed.strftime("%B %d, %Y")
@@ -40,7 +45,7 @@ def send_key_email(email: str, name: str, key: str, plan: str, expiry_date: str)
         return False
 
     try:
-        resp = http_requests.post(
+        resp = (session or http_requests).post(
             EMAILJS_API_URL,
             json={
                 "service_id": EMAILJS_SERVICE_ID,
@@ -26,7 +26,7 @@ def save_keys(data):
 
 
 def generate_key(label=None, plan=None):
-    key = secrets.token_hex(16)  # 32-char hex key
+    key = secrets.token_urlsafe(16)  # 22-char URL-safe key (older keys are 32-char hex)
     keys_data = load_keys()
     entry = {"key": key}
     if label:
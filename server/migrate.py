@@ -10,13 +10,67 @@ Migrations:
     - Add preferred_model column to keys table
     - Create email_retry_queue table for failed email delivery
     - Create active_sessions table for one-device-at-a-time enforcement
-    - Create indexes for performance optimization
+    - Create indexes for performance optimization (incl. a partial index for email retries)
 """
 import os
 import sys
-import psycopg2
+import psycopg
 from datetime import datetime
 
+# (description, SQL) pairs, applied in order inside a single transaction
+MIGRATIONS = [
+    # Migration 1: Add payment_method and stripe_session_id to orders table
+    ("1. Adding payment_method and stripe_session_id columns to orders table...", """
+        ALTER TABLE orders ADD COLUMN IF NOT EXISTS payment_method TEXT DEFAULT 'venmo';
+        ALTER TABLE orders ADD COLUMN IF NOT EXISTS stripe_session_id TEXT;
+    """),
+    # Migration 2: Add preferred_model to keys table
+    ("2. Adding preferred_model column to keys table...", """
+        ALTER TABLE keys ADD COLUMN IF NOT EXISTS preferred_model TEXT;
+    """),
+    # Migration 3: Create email_retry_queue table
+    ("3. Creating email_retry_queue table...", """
+        CREATE TABLE IF NOT EXISTS email_retry_queue (
+            id SERIAL PRIMARY KEY,
+            order_id TEXT,
+            email_type TEXT,  -- 'key_email' or 'admin_notification'
+            recipient TEXT,
+            template_params JSONB,
+            attempts INTEGER DEFAULT 0,
+            last_attempt TIMESTAMP,
+            created TIMESTAMP DEFAULT NOW()
+        );
+    """),
+    # Migration 4: Create active_sessions table
+    ("4. Creating active_sessions table...", """
+        CREATE TABLE IF NOT EXISTS active_sessions (
+            id SERIAL PRIMARY KEY,
+            access_key TEXT NOT NULL,
+            session_id TEXT UNIQUE NOT NULL,
+            started_at TIMESTAMP DEFAULT NOW(),
+            last_heartbeat TIMESTAMP DEFAULT NOW(),
+            FOREIGN KEY (access_key) REFERENCES keys(key) ON DELETE CASCADE
+        );
+    """),
+    # Migration 5: Create indexes
+    ("5. Creating database indexes...", """
+        -- last_heartbeat is rewritten on every heartbeat, so heap order doesn't
+        -- follow it and a BRIN index couldn't skip anything: keep the B-tree.
+        -- (Drops the short-lived BRIN variant where it was already created.)
+        DROP INDEX IF EXISTS idx_sessions_heartbeat_brin;
+        CREATE INDEX IF NOT EXISTS idx_sessions_heartbeat ON active_sessions(last_heartbeat);
+        -- email_retry_queue is insert-only, so created does follow heap order:
+        -- BRIN fits there at a fraction of a B-tree's size
+        CREATE INDEX IF NOT EXISTS idx_retry_queue_created
+            ON email_retry_queue USING BRIN (created);
+        CREATE INDEX IF NOT EXISTS idx_sessions_key ON active_sessions(access_key);
+        CREATE INDEX IF NOT EXISTS idx_orders_stripe_session ON orders(stripe_session_id);
+        -- Partial index matching retry_emails.py's pending-retry lookup
+        CREATE INDEX IF NOT EXISTS idx_retry_queue_pending
+            ON email_retry_queue (last_attempt NULLS FIRST, created) WHERE attempts < 5;
+    """),
+]
+
 
 def run_migration():
     """Execute database migrations."""
@@ -27,11 +81,13 @@ def run_migration():
         print("Please set DATABASE_URL to your PostgreSQL connection string")
         sys.exit(1)
 
+    # SQLAlchemy-style URLs (postgresql+psycopg://) aren't understood by libpq
+    database_url = database_url.replace("postgresql+psycopg://", "postgresql://", 1)
+
     print(f"Connecting to database...")
     try:
-        conn = psycopg2.connect(database_url)
+        conn = psycopg.connect(database_url, prepare_threshold=1)
         cur = conn.cursor()
-        conn.autocommit = True
         print("✓ Connected successfully")
     except Exception as e:
         print(f"✗ Failed to connect to database: {e}")
@@ -39,66 +95,19 @@ def run_migration():
 
     try:
         print("\n=== Starting Database Migration ===\n")
-
-        # Migration 1: Add payment_method and stripe_session_id to orders table
-        print("1. Adding payment_method and stripe_session_id columns to orders table...")
-        cur.execute("""
-            ALTER TABLE orders ADD COLUMN IF NOT EXISTS payment_method TEXT DEFAULT 'venmo';
-        """)
-        cur.execute("""
-            ALTER TABLE orders ADD COLUMN IF NOT EXISTS stripe_session_id TEXT;
-        """)
-        print("   ✓ Columns added successfully")
-
-        # Migration 2: Add preferred_model to keys table
-        print("2. Adding preferred_model column to keys table...")
-        cur.execute("""
-            ALTER TABLE keys ADD COLUMN IF NOT EXISTS preferred_model TEXT;
-        """)
-        print("   ✓ Column added successfully")
-
-        # Migration 3: Create email_retry_queue table
-        print("3. Creating email_retry_queue table...")
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS email_retry_queue (
-                id SERIAL PRIMARY KEY,
-                order_id TEXT,
-                email_type TEXT,  -- 'key_email' or 'admin_notification'
-                recipient TEXT,
-                template_params JSONB,
-                attempts INTEGER DEFAULT 0,
-                last_attempt TIMESTAMP,
-                created TIMESTAMP DEFAULT NOW()
-            );
-        """)
-        print("   ✓ email_retry_queue table created")
-
-        # Migration 4: Create active_sessions table
-        print("4. Creating active_sessions table...")
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS active_sessions (
-                id SERIAL PRIMARY KEY,
-                access_key TEXT NOT NULL,
-                session_id TEXT UNIQUE NOT NULL,
-                started_at TIMESTAMP DEFAULT NOW(),
-                last_heartbeat TIMESTAMP DEFAULT NOW(),
-                FOREIGN KEY (access_key) REFERENCES keys(key) ON DELETE CASCADE
-            );
-        """)
-        print("   ✓ active_sessions table created")
-
-        # Migration 5: Create indexes
-        print("5. Creating database indexes...")
-        cur.execute("""
-            CREATE INDEX IF NOT EXISTS idx_sessions_heartbeat ON active_sessions(last_heartbeat);
-        """)
-        cur.execute("""
-            CREATE INDEX IF NOT EXISTS idx_sessions_key ON active_sessions(access_key);
-        """)
-        cur.execute("""
-            CREATE INDEX IF NOT EXISTS idx_orders_stripe_session ON orders(stripe_session_id);
-        """)
-        print("   ✓ Indexes created successfully")
+        for description, _ in MIGRATIONS:
+            print(description)
+
+        # All DDL goes in one round-trip and one transaction: if any step
+        # fails, the earlier ones roll back instead of leaving a half-migrated schema.
+        combined_sql = "\n".join(sql for _, sql in MIGRATIONS)
+        try:
+            cur.execute(combined_sql, prepare=False)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        print("   ✓ All migrations applied")
 
         # Verify migrations
         print("\n=== Verifying Migration ===\n")
@@ -148,7 +157,8 @@ def run_migration():
         cur.execute("""
             SELECT indexname
             FROM pg_indexes
-            WHERE indexname IN ('idx_sessions_heartbeat', 'idx_sessions_key', 'idx_orders_stripe_session')
+            WHERE indexname IN ('idx_sessions_heartbeat', 'idx_sessions_key', 'idx_orders_stripe_session',
+                                'idx_retry_queue_pending', 'idx_retry_queue_created')
             ORDER BY indexname;
         """)
         indexes = [row[0] for row in cur.fetchall()]
@@ -1,6 +1,8 @@
 """
 Email retry worker for failed email deliveries.
 Run as Railway cron job: 0 * * * * python server/retry_emails.py (hourly)
+Or as a long-running worker: python server/retry_emails.py --listen
+(wakes on NOTIFY email_retry from db.add_to_email_retry_queue)
 
 This script:
 1. Finds emails that failed to send and are due for retry
@@ -10,18 +12,54 @@ This script:
 """
 import os
 import sys
-import json
+import time
 import logging
-from datetime import datetime
+from datetime import datetime, timedelta
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+_pool = None
+
+NOTIFY_CHANNEL = "email_retry"
+RETRY_BATCH_SIZE = 100
+
+
+def _normalize_url(database_url: str) -> str:
+    # SQLAlchemy-style URLs (postgresql+psycopg://) aren't understood by libpq
+    return database_url.replace("postgresql+psycopg://", "postgresql://", 1)
+
+
+def get_pool(database_url: str):
+    """Return the shared connection pool, creating it on first use.
+
+    The cron runner imports this module once and calls retry_failed_emails()
+    on every tick, so pooling saves a TCP+TLS+auth handshake per run.
+    """
+    global _pool
+    if _pool is None:
+        from psycopg_pool import ConnectionPool
+        # prepare_threshold=1: the per-email UPDATE/DELETE below get server-side
+        # prepared after their first run, so later iterations skip Parse.
+        # statement/idle timeouts keep a stuck lock (e.g. a concurrent migrate.py)
+        # from wedging the worker; they apply to every pooled connection.
+        _pool = ConnectionPool(
+            _normalize_url(database_url), min_size=1, max_size=5, open=True,
+            kwargs={
+                "autocommit": True,
+                "prepare_threshold": 1,
+                "options": "-c statement_timeout=30s -c idle_in_transaction_session_timeout=60s",
+            },
+        )
+    return _pool
+
 
 def retry_failed_emails():
     """Retry failed emails from the queue."""
+    import psycopg
+
     try:
-        import psycopg2
+        import requests as http_requests
         from email_service import send_key_email, PLAN_DISPLAY, ADMIN_EMAIL
 
         database_url = os.environ.get("DATABASE_URL")
@@ -29,79 +67,162 @@ def retry_failed_emails():
             logger.error("DATABASE_URL not set")
             return
 
-        conn = psycopg2.connect(database_url)
-        conn.autocommit = True
-        cur = conn.cursor()
-
-        # Get emails to retry (< 24 hours old, < 5 attempts, not retried in last hour)
-        cur.execute("""
-            SELECT id, order_id, email_type, recipient, template_params, attempts
-            FROM email_retry_queue
-            WHERE attempts < 5
-            AND created > NOW() - INTERVAL '24 hours'
-            AND (last_attempt IS NULL OR last_attempt < NOW() - INTERVAL '1 hour')
-        """)
-
-        pending = cur.fetchall()
-        logger.info(f"Found {len(pending)} emails to retry")
-
-        for row in pending:
-            queue_id, order_id, email_type, recipient, params_json, attempts = row
-
-            try:
-                params = json.loads(params_json) if isinstance(params_json, str) else params_json
-                logger.info(f"Retrying {email_type} for order {order_id} (attempt {attempts + 1})")
-
-                # Attempt to send email
-                if email_type == "key_email":
-                    send_key_email(
-                        recipient,
-                        params["name"],
-                        params["key"],
-                        params["plan"],
-                        params["expires"]
-                    )
-                else:
-                    logger.warning(f"Unknown email type: {email_type}")
-                    continue
+        with get_pool(database_url).connection() as conn, conn.cursor() as cur:
+            # Claim emails to retry (< 24 hours old, < 5 attempts, not retried in last hour).
+            # Cutoffs are computed here and compared against the bare columns so
+            # the planner can range-scan idx_retry_queue_pending.
+            # Claiming stamps last_attempt, and SKIP LOCKED skips rows another
+            # worker is claiming, so several workers never pick up the same email.
+            now = datetime.utcnow()
+            cur.execute("""
+                UPDATE email_retry_queue SET last_attempt = NOW()
+                WHERE id IN (
+                    SELECT id FROM email_retry_queue
+                    WHERE attempts < 5
+                    AND created > %s
+                    AND (last_attempt IS NULL OR last_attempt < %s)
+                    LIMIT %s
+                    FOR UPDATE SKIP LOCKED
+                )
+                RETURNING id, order_id, email_type, recipient, template_params, attempts
+            """, (now - timedelta(hours=24), now - timedelta(hours=1), RETRY_BATCH_SIZE))
 
-                # Delete from queue on success
-                cur.execute("DELETE FROM email_retry_queue WHERE id = %s", (queue_id,))
-                logger.info(f"✓ Email sent successfully for order {order_id}")
+            pending = cur.fetchall()
+            logger.info(f"Found {len(pending)} emails to retry")
+            if not pending:
+                return
 
-            except Exception as e:
-                logger.error(f"✗ Retry failed for order {order_id}: {e}")
+            # One keep-alive HTTP session to EmailJS for the whole batch
+            with http_requests.Session() as http:
+                # Queue writes are collected here and flushed in one pipeline below
+                success_ids: list[int] = []
+                failure_updates: list[tuple[int, int]] = []
 
-                # Update attempts
-                new_attempts = attempts + 1
-                cur.execute(
-                    "UPDATE email_retry_queue SET attempts = %s, last_attempt = NOW() WHERE id = %s",
-                    (new_attempts, queue_id)
-                )
+                for row in pending:
+                    # psycopg 3 decodes the JSONB template_params column to a dict
+                    queue_id, order_id, email_type, recipient, params, attempts = row
 
-                # If this was the 5th attempt, notify admin
-                if new_attempts >= 5:
-                    logger.error(f"Email failed 5 times for order {order_id}, giving up")
-                    # Could send admin notification here if needed
                     try:
-                        # Log critical error
-                        logger.critical(f"ADMIN ALERT: Email delivery failed after 5 attempts for order {order_id}")
-                    except Exception as notify_error:
-                        logger.error(f"Failed to notify admin: {notify_error}")
+                        logger.info(f"Retrying {email_type} for order {order_id} (attempt {attempts + 1})")
+
+                        # Attempt to send email
+                        if email_type == "key_email":
+                            sent = send_key_email(
+                                recipient,
+                                params["name"],
+                                params["key"],
+                                params["plan"],
+                                params["expires"],
+                                session=http,
+                            )
+                            if not sent:
+                                raise RuntimeError("EmailJS did not accept the email")
+                        else:
+                            logger.warning(f"Unknown email type: {email_type}")
+                            continue
+
+                        # Delete from queue on success
+                        success_ids.append(queue_id)
+                        logger.info(f"✓ Email sent successfully for order {order_id}")
+
+                    except Exception as e:
+                        logger.error(f"✗ Retry failed for order {order_id}: {e}")
+
+                        # Update attempts
+                        new_attempts = attempts + 1
+                        failure_updates.append((new_attempts, queue_id))
+
+                        # If this was the 5th attempt, notify admin
+                        if new_attempts >= 5:
+                            logger.error(f"Email failed 5 times for order {order_id}, giving up")
+                            # Could send admin notification here if needed
+                            try:
+                                # Log critical error
+                                logger.critical(f"ADMIN ALERT: Email delivery failed after 5 attempts for order {order_id}")
+                            except Exception as notify_error:
+                                logger.error(f"Failed to notify admin: {notify_error}")
+
+            # Pipeline mode sends both batches without waiting on each row's result
+            if success_ids or failure_updates:
+                with conn.pipeline():
+                    if success_ids:
+                        cur.executemany(
+                            "DELETE FROM email_retry_queue WHERE id = %s",
+                            [(i,) for i in success_ids]
+                        )
+                    if failure_updates:
+                        cur.executemany(
+                            "UPDATE email_retry_queue SET attempts = %s, last_attempt = NOW() WHERE id = %s",
+                            failure_updates
+                        )
 
-        cur.close()
-        conn.close()
         logger.info("Email retry job completed")
 
+    except psycopg.errors.QueryCanceled as e:
+        logger.error(f"Email retry queue poll timed out; will retry next run: {e}")
     except Exception as e:
+        # Logged here, raised for the caller: the cron entry point turns it
+        # into a non-zero exit, the --listen worker keeps running
         logger.error(f"Email retry job failed: {e}")
         import traceback
         traceback.print_exc()
-        sys.exit(1)
+        raise
+
+
+def listen_for_retries(poll_seconds: int = 60):
+    """Run retry passes whenever a failed email is queued.
+
+    Blocks forever on LISTEN email_retry. The poll timeout still triggers a
+    pass so rows whose one-hour backoff has elapsed get picked up even when
+    nothing new is queued.
+    """
+    import psycopg
+
+    database_url = os.environ.get("DATABASE_URL")
+    if not database_url:
+        logger.error("DATABASE_URL not set")
+        return
+
+    # LISTEN needs its own long-lived connection, outside the pool. It is
+    # (re)opened at the top of the loop, and every (re)connect is followed by
+    # a pass that drains anything queued while we weren't listening.
+    conn = None
+    try:
+        while True:
+            try:
+                if conn is None:
+                    conn = psycopg.connect(_normalize_url(database_url), autocommit=True)
+                    conn.execute(f"LISTEN {NOTIFY_CHANNEL}")
+                    logger.info(f"Listening on '{NOTIFY_CHANNEL}' (poll every {poll_seconds}s)")
+                else:
+                    for _ in conn.notifies(timeout=poll_seconds, stop_after=1):
+                        pass
+            except psycopg.OperationalError as e:
+                logger.error(f"LISTEN connection failed, reconnecting in {poll_seconds}s: {e}")
+                if conn is not None:
+                    conn.close()
+                    conn = None
+                time.sleep(poll_seconds)
+                continue
+
+            try:
+                retry_failed_emails()
+            except Exception:
+                pass  # already logged; the next wake-up tries again
+    finally:
+        if conn is not None:
+            conn.close()
 
 
 if __name__ == "__main__":
-    logger.info("=== Email Retry Job Started ===")
-    logger.info(f"Timestamp: {datetime.now().isoformat()}")
-    retry_failed_emails()
-    logger.info("=== Email Retry Job Finished ===")
+    if "--listen" in sys.argv[1:]:
+        logger.info("=== Email Retry Worker Started ===")
+        listen_for_retries()
+    else:
+        logger.info("=== Email Retry Job Started ===")
+        logger.info(f"Timestamp: {datetime.now().isoformat()}")
+        try:
+            retry_failed_emails()
+        except Exception:
+            sys.exit(1)
+        logger.info("=== Email Retry Job Finished ===")
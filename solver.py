@@ -1,32 +1,113 @@
 from __future__ import annotations
 import re
+import json
+import time
+import atexit
+import asyncio
 import random
 import logging
-import requests
+from collections import OrderedDict
+from typing import TYPE_CHECKING
+
+try:
+    import orjson  # optional: much faster on prompts with long textbook passages
+except ImportError:
+    orjson = None
 
 import config
 import human
+import answer_cache
+import heuristics
 from models import QuestionData, Action
 
+if TYPE_CHECKING:
+    import requests
+
 logger = logging.getLogger(__name__)
 
+# Response-parsing patterns, compiled once (parse runs for every question)
+_ANSWER_BLOCK_RE = re.compile(r'ANSWER:\s*\n?([\s\S]+)$', re.IGNORECASE)
+_NUM_PREFIX_RE = re.compile(r'^\d+[\.\)\:]\s*')
+_DASH_PREFIX_RE = re.compile(r'^-\s*')
+_NUM_COLON_RE = re.compile(r'^\d+[\.:]\s*')
+_SPLIT_SEMI_NL_RE = re.compile(r';\s*|\n')
+# Punctuation models put around choice letters, e.g. "B)", "C.", "A:"
+_STRIP_PUNCT = str.maketrans("", "", "):.")
+# Candidate choice labels in an upper-cased reply ("**B**", "The answer is C")
+_LABEL_TOKEN_RE = re.compile(r'[A-Z0-9]+')
+
+# Transient failures worth retrying in get_answer (403/429 are never retried)
+_SOLVE_ATTEMPTS = 5
+_RETRY_STATUSES = {502, 503, 504}
+# (connect, read): an unreachable server fails fast and gets retried, while
+# the read side still allows for a slow model answer
+_SOLVE_TIMEOUT = (5, 30)
+# After a 403, fail further solves locally for this long instead of asking again
+_AUTH_FAIL_COOLDOWN = 30.0
+# Prompts per /api/solve/many request: the server's MULTI_MAX_PROMPTS, which
+# it answers in a single parallel wave
+_SOLVE_MANY_MAX = 8
+
 _access_key: str | None = None
 _server_url: str | None = None
 _session_start_time: str | None = None
+_http: requests.Session | None = None
+_async_http = None  # httpx.AsyncClient, created on first async call
+_async_http_loop: asyncio.AbstractEventLoop | None = None
+_inflight: dict[str, asyncio.Future] = {}  # prompt key -> pending answer text
+_auth_failed_until = 0.0  # time.monotonic() deadline set by a 403
+_auth_error = ""
+
+
+def _get_http() -> requests.Session:
+    """Return the shared HTTP session so every call reuses one TLS connection."""
+    global _http
+    if _http is None:
+        # requests/urllib3 are imported on first use so that importing solver
+        # (e.g. just to parse responses) stays cheap
+        import requests
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+
+        _http = requests.Session()
+        # urllib3 would retry failed connects for every method, stacking on
+        # get_answer's own loop, so connect=0: solve POSTs are retried only
+        # there and main.py's session calls fail after one attempt. Status
+        # retries (502/503/504) only apply to idempotent methods, i.e. the
+        # health check. 429/500 aren't retried: "back off" / a model error.
+        adapter = HTTPAdapter(
+            pool_connections=4, pool_maxsize=8,
+            max_retries=Retry(total=3, connect=0, backoff_factor=0.3,
+                              status_forcelist=[502, 503, 504], raise_on_status=False),
+        )
+        _http.mount("https://", adapter)
+        _http.mount("http://", adapter)  # local dev server
+        atexit.register(_http.close)
+    return _http
+
 
+def http_session() -> requests.Session:
+    """The shared keep-alive session, for other calls to the same server."""
+    return _get_http()
 
-def init_client(access_key: str | None = None, session_start_time: str | None = None) -> None:
-    """Store the access key and verify the server is reachable."""
-    global _access_key, _server_url, _session_start_time
+
+def init_client(access_key: str | None = None, session_start_time: str | None = None,
+                verify: bool = True) -> None:
+    """Store the access key and, if verify, check the server is reachable."""
+    global _access_key, _server_url, _session_start_time, _auth_failed_until
     _access_key = access_key or config.ACCESS_KEY
+    _auth_failed_until = 0.0
     _server_url = config.SERVER_URL
     _session_start_time = session_start_time
 
     if not _access_key:
         raise ValueError("Access key not set. Please enter your access key.")
+    if not verify:
+        return
 
+    import requests
     try:
-        resp = requests.get(f"{_server_url}/health", timeout=5)
+        resp = _get_http().get(f"{_server_url}/health", timeout=5)
         resp.raise_for_status()
     except requests.ConnectionError:
         raise ConnectionError(f"Cannot reach server at {_server_url}. Is it running?")
@@ -34,301 +115,696 @@ def init_client(access_key: str | None = None, session_start_time: str | None =
         raise ConnectionError(f"Server error: {e}")
 
 
+def _prepare(question_data: QuestionData) -> tuple[dict, list[str], Action | None]:
+    """Build the solve payload and cache keys, answering locally if possible."""
+    if time.monotonic() < _auth_failed_until:
+        raise PermissionError(_auth_error)
+
+    direct = heuristics.try_direct(question_data)
+    if direct is not None:
+        logger.info(f"Answered without the model: {direct}")
+        return {}, [], parse_gpt_response(direct, question_data)
+
+    payload = _build_payload(question_data)
+    cache_keys = _answer_cache_keys(payload, question_data)
+    cached = _cached_answer(cache_keys, payload["model"], question_data)
+    if cached is not None:
+        logger.info(f"Cached response: {cached}")
+        return payload, cache_keys, parse_gpt_response(cached, question_data)
+    return payload, cache_keys, None
+
+
 def get_answer(question_data: QuestionData) -> Action:
     """Send a question to the server and return a parsed Action."""
     if _access_key is None:
         init_client()
 
-    prompt = _build_prompt(question_data)
+    payload, cache_keys, local = _prepare(question_data)
+    if local is not None:
+        return local
+
+    import requests
+    url = f"{_server_url}/api/solve"
+    body = _dumps(payload)
+    for attempt in range(_SOLVE_ATTEMPTS):
+        last_try = attempt == _SOLVE_ATTEMPTS - 1
+        try:
+            resp = _get_http().post(url, data=body, headers=_JSON_HEADERS,
+                                    timeout=_SOLVE_TIMEOUT)
+        except requests.ConnectionError:
+            if last_try:
+                raise
+            reason = "connection error"
+        else:
+            if resp.status_code not in _RETRY_STATUSES or last_try:
+                break
+            reason = f"HTTP {resp.status_code}"
+        # Exponential backoff, 0.1s doubling up to 10s, plus jitter
+        delay = min(10.0, 0.1 * 2 ** attempt) + random.uniform(0, 0.1)
+        logger.warning(f"Solve request failed ({reason}), retrying in {delay:.2f}s")
+        time.sleep(delay)
+
+    answer_text = _answer_from_response(resp)
+    return _remember_answer(answer_text, cache_keys, payload["model"], question_data)
+
+
+async def get_answer_async(question_data: QuestionData) -> Action:
+    """Async counterpart of get_answer, for solving several questions at once.
+
+    Requests share one HTTP/2 connection, so callers can
+    ``asyncio.gather(*(get_answer_async(q) for q in questions))``.
+    Requires ``httpx[http2]``.
+    """
+    if _access_key is None:
+        init_client()
+
+    payload, cache_keys, local = _prepare(question_data)
+    if local is not None:
+        return local
+
+    # Identical prompts already in flight share one request (singleflight)
+    key = answer_cache.make_key(payload["model"], payload["temperature"], payload["prompt"])
+    task = _inflight.get(key)
+    if task is None:
+        task = asyncio.ensure_future(_post_solve_async(payload))
+        _inflight[key] = task
+        task.add_done_callback(lambda _: _inflight.pop(key, None))
+    # shield: one caller being cancelled mustn't cancel the others' request
+    answer_text = await asyncio.shield(task)
+    return _remember_answer(answer_text, cache_keys, payload["model"], question_data)
+
+
+async def _post_solve_async(payload: dict) -> str:
+    resp = await _get_async_http().post(f"{_server_url}/api/solve", content=_dumps(payload),
+                                        headers=_JSON_HEADERS)
+    return _answer_from_response(resp)
+
+
+async def solve_batch(questions: list[QuestionData],
+                      max_concurrency: int | None = None) -> list[Action]:
+    """Solve independent questions concurrently, returning Actions in order.
+
+    At most ``max_concurrency`` (default config.MAX_CONCURRENCY) requests are
+    in flight at once, so a large batch doesn't trip the server's rate limit.
+    """
+    sem = asyncio.Semaphore(max_concurrency or config.MAX_CONCURRENCY)
+
+    async def one(q: QuestionData) -> Action:
+        async with sem:
+            return await get_answer_async(q)
+
+    return await asyncio.gather(*(one(q) for q in questions))
+
+
+def get_answers_batch(questions: list[QuestionData]) -> list[Action]:
+    """Solve several questions together, returning Actions in order.
+
+    Questions not answered locally go to the server's /api/solve/many in
+    groups of _SOLVE_MANY_MAX, each answered by one parallel wave of model
+    calls. Against an older server without that endpoint, falls back to
+    solve_batch.
+    """
+    if _access_key is None:
+        init_client()
+
+    prepared = [_prepare(q) for q in questions]
+    todo = [i for i, (_, _, local) in enumerate(prepared) if local is None]
+    actions = [local for _, _, local in prepared]
+    if not todo:
+        return actions
+
+    answers: list[str | None] = []
+    for start in range(0, len(todo), _SOLVE_MANY_MAX):
+        group = _post_solve_many([prepared[i][0] for i in todo[start:start + _SOLVE_MANY_MAX]])
+        if group is None:
+            return asyncio.run(solve_batch(questions))
+        answers += group
+
+    for i, answer_text in zip(todo, answers):
+        payload, cache_keys, _ = prepared[i]
+        if answer_text is None:  # that prompt's model call failed server-side
+            actions[i] = get_answer(questions[i])
+        else:
+            actions[i] = _remember_answer(answer_text, cache_keys, payload["model"], questions[i])
+    return actions
+
+
+def _post_solve_many(payloads: list[dict]) -> list[str | None] | None:
+    """POST payloads as one /api/solve/many request; None if unsupported."""
+    body = {
+        "access_key": _access_key,
+        "prompts": [p["prompt"] for p in payloads],
+        "max_tokens": [p.get("max_tokens") for p in payloads],
+        "stop_at_answer": [p.get("stop_at_answer", False) for p in payloads],
+        "model": payloads[0]["model"],
+        "temperature": payloads[0]["temperature"],
+    }
+    if _session_start_time:
+        body["session_start_time"] = _session_start_time
+    resp = _get_http().post(f"{_server_url}/api/solve/many", data=_dumps(body),
+                            headers=_JSON_HEADERS, timeout=(_SOLVE_TIMEOUT[0], 60))
+    if resp.status_code == 404:
+        return None
+    if resp.status_code != 200:
+        _answer_from_response(resp)  # raises the matching error
+    return _response_json(resp)["answers"]
+
+
+def submit_batch(questions: list[QuestionData]) -> str:
+    """Queue questions as one server-side OpenAI batch and return its id.
+
+    For bulk runs that don't need answers right away: batches cost half as
+    much but can take up to 24h. Collect results with wait_for_batch.
+    """
+    if _access_key is None:
+        init_client()
+
+    payload = {
+        "access_key": _access_key,
+        "prompts": [_build_prompt(q) for q in questions],
+        "model": config.GPT_MODEL,
+        "temperature": config.GPT_TEMPERATURE,
+    }
+    resp = _get_http().post(f"{_server_url}/api/solve/batch", data=_dumps(payload),
+                            headers=_JSON_HEADERS, timeout=60)
+    if resp.status_code != 200:
+        _answer_from_response(resp)  # raises the matching error
+    return _response_json(resp)["batch_id"]
+
+
+def wait_for_batch(batch_id: str, questions: list[QuestionData],
+                   poll: float = 30.0) -> list[Action | None]:
+    """Block until a batch finishes; return Actions in question order.
+
+    Questions the batch produced no answer for come back as None.
+    """
+    if _access_key is None:
+        init_client()
+
+    url = f"{_server_url}/api/solve/batch/status"
+    body = _dumps({"access_key": _access_key, "batch_id": batch_id})
+    while True:
+        resp = _get_http().post(url, data=body, headers=_JSON_HEADERS, timeout=60)
+        if resp.status_code != 200:
+            _answer_from_response(resp)
+        result = _response_json(resp)
+        status = result["status"]
+        if status == "completed":
+            break
+        if status in ("failed", "expired", "cancelled"):
+            raise RuntimeError(f"Batch {batch_id} {status}")
+        logger.info(f"Batch {batch_id} {status}, checking again in {poll:.0f}s")
+        time.sleep(poll)
+
+    answers = result.get("answers", {})
+    return [parse_gpt_response(answers[str(i)], q) if answers.get(str(i)) else None
+            for i, q in enumerate(questions)]
+
+
+def _get_async_http():
+    """Return the HTTP/2 client for the running event loop.
+
+    In-flight requests are multiplexed over one connection. Pooled
+    connections belong to the loop that opened them, so a later asyncio.run()
+    (e.g. a second solve_batch call) gets a fresh client.
+    """
+    global _async_http, _async_http_loop
+    loop = asyncio.get_running_loop()
+    if _async_http is None or _async_http_loop is not loop:
+        import httpx
+        _async_http = httpx.AsyncClient(
+            http2=True, timeout=httpx.Timeout(_SOLVE_TIMEOUT[1], connect=_SOLVE_TIMEOUT[0]),
+            limits=httpx.Limits(max_keepalive_connections=config.MAX_CONCURRENCY,
+                                max_connections=2 * config.MAX_CONCURRENCY),
+        )
+        _async_http_loop = loop
+    return _async_http
+
+
+# Output-token caps for the reply-only prompts (a bare letter or one short
+# fill). Types that still reason step-by-step keep the server's default cap.
+# mc_single leaves room for a short lead-in such as "The answer is B."
+_MAX_TOKENS = {"mc_single": 8, "fill": 64}
 
+
+def _max_tokens(qd: QuestionData) -> int | None:
+    if qd.type == "fill" and qd.blank_count > 1:
+        return None
+    return _MAX_TOKENS.get(qd.type)
+
+
+def _stop_at_answer(qd: QuestionData) -> bool:
+    """Whether the server may end the reply at the first complete ANSWER line.
+
+    Only for types whose whole answer sits on that line; ordering and
+    matching answers continue on the lines after it.
+    """
+    if qd.type == "fill":
+        return qd.blank_count > 1
+    return qd.type in ("mc_multi", "dropdown")
+
+
+_JSON_HEADERS = {"Content-Type": "application/json"}
+
+
+def _dumps(payload: dict) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(payload)
+    return json.dumps(payload).encode()
+
+
+def _response_json(resp) -> dict:
+    """Decode a requests/httpx response body."""
+    if orjson is not None:
+        return orjson.loads(resp.content)
+    return json.loads(resp.content)
+
+
+def _build_payload(question_data: QuestionData) -> dict:
     payload = {
         "access_key": _access_key,
-        "prompt": prompt,
+        "prompt": _build_prompt(question_data),
         "model": config.GPT_MODEL,
         "temperature": config.GPT_TEMPERATURE,
     }
+    max_tokens = _max_tokens(question_data)
+    if max_tokens:
+        payload["max_tokens"] = max_tokens
+    if _stop_at_answer(question_data):
+        payload["stop_at_answer"] = True
 
     # Include session start time for grace period logic (if available)
     if _session_start_time:
         payload["session_start_time"] = _session_start_time
-
-    resp = requests.post(f"{_server_url}/api/solve", json=payload, timeout=30)
-
+    return payload
+
+
+def _answer_cache_keys(payload: dict, question_data: QuestionData) -> list[str]:
+    """Cache keys for a solve payload (exact prompt first), or [] when answers
+    aren't deterministic."""
+    if not config.ENABLE_ANSWER_CACHE or payload["temperature"] != 0:
+        return []
+    return [
+        answer_cache.make_key(payload["model"], payload["temperature"], payload["prompt"]),
+        answer_cache.make_question_key(payload["model"], question_data),
+    ]
+
+
+def _cached_answer(keys: list[str], model: str, question_data: QuestionData) -> str | None:
+    for key in keys:
+        cached = answer_cache.get(key)
+        if cached is not None:
+            return cached
+    if keys and config.ENABLE_GENCACHE:
+        return answer_cache.get_variant(model, question_data)
+    return None
+
+
+def _is_usable(action: Action) -> bool:
+    """Whether a parsed answer gives the page something to click or enter."""
+    if action.type in ("click", "multi_click"):
+        return bool(action.targets)
+    return any(action.values) or bool(action.ordered_items) or bool(action.matches)
+
+
+def _remember_answer(answer_text: str, keys: list[str], model: str,
+                     question_data: QuestionData) -> Action:
+    """Parse a fresh answer, caching it under keys only if it parsed to
+    something usable (a truncated or off-format reply must not stick for
+    ANSWER_CACHE_TTL)."""
+    action = parse_gpt_response(answer_text, question_data)
+    if not keys or not _is_usable(action):
+        return action
+    for key in keys:
+        answer_cache.put(key, answer_text)
+    if config.ENABLE_GENCACHE and action.targets:
+        answer_cache.put_variant(model, question_data, action.answer_text.split(", "))
+    return action
+
+
+def _answer_from_response(resp) -> str:
+    """Map a /api/solve response (requests or httpx) to the answer text or raise."""
     if resp.status_code == 403:
-        error_msg = resp.json().get("error", "")
+        global _auth_failed_until, _auth_error
+        error_msg = _response_json(resp).get("error", "")
         if "expired" in error_msg.lower():
-            raise PermissionError("Access key expired. Please renew your subscription.")
-        raise PermissionError("Invalid access key.")
+            _auth_error = "Access key expired. Please renew your subscription."
+        else:
+            _auth_error = "Invalid access key."
+        _auth_failed_until = time.monotonic() + _AUTH_FAIL_COOLDOWN
+        raise PermissionError(_auth_error)
     elif resp.status_code == 429:
         raise RuntimeError("Rate limit exceeded. Try again later.")
     elif resp.status_code != 200:
-        error_msg = resp.json().get("error", "Unknown server error")
+        error_msg = _response_json(resp).get("error", "Unknown server error")
         raise RuntimeError(f"Server error: {error_msg}")
 
-    answer_text = resp.json()["answer"]
+    answer_text = _response_json(resp)["answer"]
     logger.info(f"Server response: {answer_text}")
-
-    return parse_gpt_response(answer_text, question_data)
+    return answer_text
 
 
 # ── Prompt Building ───────────────────────────────────────────────
 
+# Fixed per-type instructions, placed at the start of every prompt
+_PROMPT_TEMPLATES: dict[str, str] = {
+    "ordering": (
+        "Put the following items in the correct order.\n"
+        "Reply with ONLY the items in the correct order, one per line, "
+        "numbered 1, 2, 3, etc. Use the EXACT text of each item."
+    ),
+    "matching": (
+        "Match each item on the left with the correct item on the right.\n"
+        "Reply with each match on its own line in the format:\n"
+        "Left Item -> Right Item\n"
+        "Use the EXACT text of each item."
+    ),
+    # No chain-of-thought for single-answer questions: the reply is a handful
+    # of tokens and output length is most of the latency.
+    "mc_single": (
+        "Answer the multiple-choice question below.\n"
+        "Reply with ONLY the letter of the correct answer."
+    ),
+    "mc_multi": (
+        "Answer the multiple-choice question below. "
+        "Select ALL correct options. Think step-by-step, then on the LAST "
+        "line write ONLY:\n"
+        "ANSWER: <letters separated by commas>\n"
+        "Example: ANSWER: A, C"
+    ),
+    "fill": (
+        "Fill in the blank. The answer may be one or more words.\n"
+        "Reply with ONLY the answer, no explanation.\n"
+        "Use the exact terminology from the textbook passage when possible."
+    ),
+    "fill_multi": (
+        "Fill in every blank. Each blank may require one or more words.\n"
+        "Think step-by-step using the textbook passage, then on "
+        "the LAST line write ONLY:\n"
+        "ANSWER: answer1; answer2; answer3\n"
+        "Separate each blank's answer with a semicolon. Use the exact "
+        "terminology from the textbook passage when possible."
+    ),
+    "dropdown": (
+        "Fill in each blank with the correct option from the choices given. "
+        "Think step-by-step, then on the LAST line write ONLY:\n"
+        "ANSWER: 1: chosen_option; 2: chosen_option"
+    ),
+    "fallback": (
+        "Think step-by-step, then on the LAST line write ONLY:\n"
+        "ANSWER: <your answer>"
+    ),
+}
+
+_CONTEXT_INTRO = (
+    "The following passage is from the textbook. Use it as your PRIMARY "
+    "source when answering:\n\n"
+)
+
+
+def _bullets(items: list[str]) -> str:
+    """Render items as a "- item" list with a single join."""
+    return "- " + "\n- ".join(items) if items else ""
+
+
+# Recently built prompts, so re-solving the same question skips assembly
+# (parser caps the passage at ~2000 chars, so 256 entries stay around 1-2 MB)
+_PROMPT_CACHE_SIZE = 256
+_prompt_cache: OrderedDict[tuple, str] = OrderedDict()
+
+
+def _prompt_key(qd: QuestionData) -> tuple:
+    """Everything _render_prompt reads from qd, as a hashable tuple."""
+    return (
+        qd.type, qd.question, qd.context, qd.blank_count,
+        tuple(qd.items), tuple(qd.sources), tuple(qd.targets),
+        tuple((c.get("label"), c.get("text"), tuple(c.get("options", ())))
+              for c in qd.choices),
+    )
+
+
 def _build_prompt(qd: QuestionData) -> str:
-    """Build the prompt based on question type."""
-    ctx = ""
-    if qd.context:
-        ctx = (
-            f"The following passage is from the textbook. Use it as your PRIMARY "
-            f"source when answering:\n\n{qd.context}\n\n"
-        )
+    """Build the prompt based on question type (memoized)."""
+    key = _prompt_key(qd)
+    prompt = _prompt_cache.get(key)
+    if prompt is not None:
+        _prompt_cache.move_to_end(key)
+        return prompt
+
+    prompt = _render_prompt(qd)
+    _prompt_cache[key] = prompt
+    if len(_prompt_cache) > _PROMPT_CACHE_SIZE:
+        _prompt_cache.popitem(last=False)
+    return prompt
+
+
+def _ordering_section(parts: list[str], qd: QuestionData) -> None:
+    parts += (
+        "Question: ", qd.question, "\n\n"
+        "Items (currently in this order):\n", _bullets(qd.items), "\n\n"
+        "Correct order:",
+    )
 
-    if qd.type == "ordering":
-        items_text = "\n".join(f"- {item}" for item in qd.items)
-        return (
-            f"{ctx}"
-            f"Put the following items in the correct order.\n\n"
-            f"Question: {qd.question}\n\n"
-            f"Items (currently in this order):\n{items_text}\n\n"
-            f"Reply with ONLY the items in the correct order, one per line, "
-            f"numbered 1, 2, 3, etc. Use the EXACT text of each item.\n\n"
-            f"Correct order:"
-        )
 
-    if qd.type == "matching":
-        sources_text = "\n".join(f"- {s}" for s in qd.sources)
-        targets_text = "\n".join(f"- {t}" for t in qd.targets)
-        return (
-            f"{ctx}"
-            f"Match each item on the left with the correct item on the right.\n\n"
-            f"Question: {qd.question}\n\n"
-            f"Left items:\n{sources_text}\n\n"
-            f"Right items:\n{targets_text}\n\n"
-            f"Reply with each match on its own line in the format:\n"
-            f"Left Item -> Right Item\n"
-            f"Use the EXACT text of each item.\n\n"
-            f"Matches:"
-        )
+def _matching_section(parts: list[str], qd: QuestionData) -> None:
+    parts += (
+        "Question: ", qd.question, "\n\n"
+        "Left items:\n", _bullets(qd.sources), "\n\n"
+        "Right items:\n", _bullets(qd.targets), "\n\n"
+        "Matches:",
+    )
 
-    if qd.type == "mc_single":
-        choices_text = "\n".join(f"{c['label']}) {c['text']}" for c in qd.choices)
-        labels = ", ".join(c["label"] for c in qd.choices)
-        return (
-            f"{ctx}"
-            f"Question: {qd.question}\n\n"
-            f"{choices_text}\n\n"
-            f"Think step-by-step, then on the LAST line write ONLY:\n"
-            f"ANSWER: <letter>\n"
-            f"where <letter> is one of {labels}."
-        )
 
-    if qd.type == "mc_multi":
-        choices_text = "\n".join(f"{c['label']}) {c['text']}" for c in qd.choices)
-        return (
-            f"{ctx}"
-            f"Question: {qd.question}\n\n"
-            f"{choices_text}\n\n"
-            f"Select ALL correct options. Think step-by-step, then on the LAST "
-            f"line write ONLY:\n"
-            f"ANSWER: <letters separated by commas>\n"
-            f"Example: ANSWER: A, C"
-        )
+def _choices_section(parts: list[str], qd: QuestionData) -> list[str]:
+    # Labels are read once and shared by the choices and valid-letters lines
+    labels = [c["label"] for c in qd.choices]
+    texts = [c["text"] for c in qd.choices]
+    parts += ("Question: ", qd.question, "\n\n",
+              "\n".join(map("{}) {}".format, labels, texts)))
+    return labels
 
-    if qd.type == "fill":
-        if qd.blank_count > 1:
-            return (
-                f"{ctx}"
-                f"Question: {qd.question}\n\n"
-                f"This question has exactly {qd.blank_count} blanks to fill in. "
-                f"Each blank may require one or more words.\n\n"
-                f"Think step-by-step using the textbook passage above, then on "
-                f"the LAST line write ONLY:\n"
-                f"ANSWER: answer1; answer2; answer3\n"
-                f"Separate each blank's answer with a semicolon. Use the exact "
-                f"terminology from the textbook passage when possible."
-            )
-        return (
-            f"{ctx}"
-            f"Question: {qd.question}\n\n"
-            f"Fill in the blank. The answer may be one or more words.\n\n"
-            f"Think step-by-step using the textbook passage above, then on "
-            f"the LAST line write ONLY:\n"
-            f"ANSWER: <your answer>\n"
-            f"Use the exact terminology from the textbook passage when possible."
-        )
 
-    if qd.type == "dropdown":
-        dropdown_info = ""
-        for i, c in enumerate(qd.choices):
-            opts = ", ".join(c.get("options", []))
-            dropdown_info += f"Blank {i+1} options: {opts}\n"
-        return (
-            f"{ctx}"
-            f"Sentence: {qd.question}\n\n"
-            f"{dropdown_info}\n"
-            f"Fill in each blank with the correct option from the choices given. "
-            f"Think step-by-step, then on the LAST line write ONLY:\n"
-            f"ANSWER: 1: chosen_option; 2: chosen_option"
-        )
+def _mc_single_section(parts: list[str], qd: QuestionData) -> None:
+    labels = _choices_section(parts, qd)
+    parts += ("\n\nValid letters: ", ", ".join(labels))
 
-    # Fallback
-    return (
-        f"{ctx}"
-        f"Question: {qd.question}\n\n"
-        f"Think step-by-step, then on the LAST line write ONLY:\n"
-        f"ANSWER: <your answer>"
+
+def _fill_multi_section(parts: list[str], qd: QuestionData) -> None:
+    parts += (
+        "Question: ", qd.question, "\n\n"
+        "This question has exactly ", str(qd.blank_count), " blanks to fill in.",
     )
 
 
+def _dropdown_section(parts: list[str], qd: QuestionData) -> None:
+    parts += ("Sentence: ", qd.question, "\n\n")
+    parts.append("\n".join(f"Blank {i + 1} options: {', '.join(c.get('options', []))}"
+                            for i, c in enumerate(qd.choices)))
+
+
+def _question_section(parts: list[str], qd: QuestionData) -> None:
+    parts += ("Question: ", qd.question)
+
+
+# Appends the per-type question section (after the template and passage)
+_QUESTION_SECTIONS = {
+    "ordering": _ordering_section,
+    "matching": _matching_section,
+    "mc_single": _mc_single_section,
+    "mc_multi": _choices_section,
+    "fill_multi": _fill_multi_section,
+    "dropdown": _dropdown_section,
+}
+
+
+def _render_prompt(qd: QuestionData) -> str:
+    """Assemble the prompt text for qd's question type.
+
+    The fixed instructions for the type come first, then the passage,
+    question and options.
+    """
+    q_type = qd.type
+    if q_type == "fill" and qd.blank_count > 1:
+        q_type = "fill_multi"
+    elif q_type not in _PROMPT_TEMPLATES:
+        q_type = "fallback"
+
+    parts: list[str] = [_PROMPT_TEMPLATES[q_type], "\n\n"]
+    if qd.context:
+        parts += (_CONTEXT_INTRO, qd.context, "\n\n")
+
+    _QUESTION_SECTIONS.get(q_type, _question_section)(parts, qd)
+    return "".join(parts)
+
+
 # ── Response Parsing ──────────────────────────────────────────────
 
 def _extract_answer_line(response_text: str) -> str:
     """Extract the answer from the ANSWER: line at the end of a chain-of-thought response."""
-    match = re.search(r'(?i)^ANSWER:\s*(.+)$', response_text.strip(), re.MULTILINE)
-    if match:
-        return match.group(1).strip()
-    lines = [l.strip() for l in response_text.strip().split("\n") if l.strip()]
-    return lines[-1] if lines else response_text.strip()
+    # Fast path: the answer is usually the last line and the only ANSWER:
+    # in the text, so skip splitting a long chain of thought.
+    stripped = response_text.strip()
+    tail = stripped[stripped.rfind("\n") + 1:].strip()
+    if tail[:7].upper() == "ANSWER:" and tail[7:].strip() \
+            and stripped.upper().count("ANSWER:") == 1:
+        return tail[7:].strip()
+
+    # Plain prefix test per line; the first ANSWER: line wins. A bare
+    # "ANSWER:" takes the next non-empty line.
+    lines = [l.strip() for l in stripped.split("\n") if l.strip()]
+    for i, line in enumerate(lines):
+        if line[:7].upper() == "ANSWER:":
+            rest = line[7:].strip()
+            if rest:
+                return rest
+            if i + 1 < len(lines):
+                return lines[i + 1]
+    return lines[-1] if lines else ""
+
+
+def _choices_by_label(qd: QuestionData) -> dict[str, dict]:
+    """Map upper-cased choice label -> choice (first one wins on duplicates)."""
+    return {c["label"].upper(): c for c in reversed(qd.choices)}
+
+
+def _parse_ordering(response_text: str, qd: QuestionData) -> Action:
+    text = response_text.strip()
+    answer_match = _ANSWER_BLOCK_RE.search(text)
+    if answer_match:
+        text = answer_match.group(1).strip()
+
+    ordered_items = []
+    for line in text.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        # Only numbered/dashed lines can need their prefix stripped
+        if line[0].isdigit() or line[0] == "-":
+            line = _NUM_PREFIX_RE.sub('', line).strip()
+            line = _DASH_PREFIX_RE.sub('', line).strip()
+        if line:
+            ordered_items.append(line)
 
+    return Action(
+        type="ordering",
+        answer_text=" -> ".join(ordered_items),
+        ordered_items=ordered_items,
+        item_elements=qd.item_elements,
+        original_items=qd.items,
+    )
 
-def parse_gpt_response(response_text: str, qd: QuestionData) -> Action:
-    """Parse the model's response into an Action."""
 
-    if qd.type == "ordering":
-        text = response_text.strip()
-        answer_match = re.search(r'(?i)ANSWER:\s*\n?([\s\S]+)$', text)
-        if answer_match:
-            text = answer_match.group(1).strip()
-
-        ordered_items = []
-        for line in text.split("\n"):
-            line = line.strip()
-            if not line:
-                continue
-            line = re.sub(r'^\d+[\.\)\:]\s*', '', line).strip()
-            line = re.sub(r'^-\s*', '', line).strip()
-            if line:
-                ordered_items.append(line)
-
-        return Action(
-            type="ordering",
-            answer_text=" -> ".join(ordered_items),
-            ordered_items=ordered_items,
-            item_elements=qd.item_elements,
-            original_items=qd.items,
-        )
+def _parse_matching(response_text: str, qd: QuestionData) -> Action:
+    text = response_text.strip()
+    answer_match = _ANSWER_BLOCK_RE.search(text)
+    if answer_match:
+        text = answer_match.group(1).strip()
 
-    if qd.type == "matching":
-        text = response_text.strip()
-        answer_match = re.search(r'(?i)ANSWER:\s*\n?([\s\S]+)$', text)
-        if answer_match:
-            text = answer_match.group(1).strip()
-
-        matches = []
-        for line in text.split("\n"):
-            line = line.strip()
-            if "->" in line:
-                parts = line.split("->", 1)
-                left = parts[0].strip().lstrip("- ")
-                right = parts[1].strip()
-                matches.append({"source": left, "target": right})
-            elif ":" in line and not line[0].isdigit():
-                parts = line.split(":", 1)
-                left = parts[0].strip().lstrip("- ")
-                right = parts[1].strip()
-                matches.append({"source": left, "target": right})
-
-        return Action(
-            type="matching",
-            answer_text=", ".join(f"{m['source']}->{m['target']}" for m in matches),
-            matches=matches,
-            source_elements=qd.source_elements,
-            target_elements=qd.target_elements,
-            sources=qd.sources,
-            targets_list=qd.targets,
-        )
+    matches = []
+    for line in text.splitlines():
+        if "->" in line:
+            left, right = line.split("->", 1)
+        elif ":" in line and not line.lstrip()[0].isdigit():
+            left, right = line.split(":", 1)
+        else:
+            continue
+        matches.append({"source": left.strip().lstrip("- "), "target": right.strip()})
+
+    return Action(
+        type="matching",
+        answer_text=", ".join(f"{m['source']}->{m['target']}" for m in matches),
+        matches=matches,
+        source_elements=qd.source_elements,
+        target_elements=qd.target_elements,
+        sources=qd.sources,
+        targets_list=qd.targets,
+    )
 
-    if qd.type == "mc_single":
-        answer = _extract_answer_line(response_text)
-        letter = answer.upper().replace(")", "").replace(".", "").replace(":", "").strip()
-        if len(letter) > 1:
-            letter = letter[0]
 
-        target = None
-        for c in qd.choices:
-            if c["label"].upper() == letter:
-                target = c.get("element")
-                break
+def _parse_mc_single(response_text: str, qd: QuestionData) -> Action:
+    # The reply is usually a bare letter, but may come wrapped in markdown or
+    # a lead-in: take the first token that is one of the choice labels,
+    # looking at the answer line first and then the whole reply.
+    choices_by_label = _choices_by_label(qd)
+    tokens = _LABEL_TOKEN_RE.findall(_extract_answer_line(response_text).upper())
+    letter = next((t for t in tokens + _LABEL_TOKEN_RE.findall(response_text.upper())
+                   if t in choices_by_label), None)
+    if letter is None:
+        # Nothing matches: report the first single-character token, if any
+        letter = next((t for t in tokens if len(t) == 1), "")
 
-        return Action(
-            type="click",
-            answer_text=letter,
-            targets=[target] if target else [],
-        )
+    target = choices_by_label.get(letter, {}).get("element")
 
-    if qd.type == "mc_multi":
-        answer = _extract_answer_line(response_text)
-        letters = [l.strip().upper().replace(")", "").replace(".", "")
-                   for l in answer.split(",")]
-
-        targets = []
-        for letter in letters:
-            for c in qd.choices:
-                if c["label"].upper() == letter:
-                    el = c.get("element")
-                    if el:
-                        targets.append(el)
-                    break
-
-        return Action(
-            type="multi_click",
-            answer_text=", ".join(letters),
-            targets=targets,
-        )
+    return Action(
+        type="click",
+        answer_text=letter,
+        targets=[target] if target else [],
+    )
 
-    if qd.type == "fill":
-        inputs = qd.input_elements
-        answer = _extract_answer_line(response_text)
-
-        if qd.blank_count > 1:
-            values = [v.strip() for v in answer.split(";") if v.strip()]
-            if len(values) == 1 and len(inputs) > 1:
-                values = [v.strip() for v in answer.split(",") if v.strip()]
-            if len(values) == 1 and len(inputs) > 1:
-                values = [v.strip() for v in answer.split("\n") if v.strip()]
-            values = [re.sub(r'^\d+[\.:]\s*', '', v) for v in values]
-            while len(values) < len(inputs):
-                values.append("")
-            values = values[:len(inputs)]
-        else:
-            values = [answer]
 
-        return Action(
-            type="multi_type",
-            answer_text="; ".join(values),
-            targets=inputs,
-            values=values,
-        )
+def _parse_mc_multi(response_text: str, qd: QuestionData) -> Action:
+    answer = _extract_answer_line(response_text)
+    letters = [l.strip().upper().translate(_STRIP_PUNCT) for l in answer.split(",")]
+
+    choices_by_label = _choices_by_label(qd)
+    targets = []
+    for letter in letters:
+        c = choices_by_label.get(letter)
+        if c and c.get("element"):
+            targets.append(c["element"])
+
+    return Action(
+        type="multi_click",
+        answer_text=", ".join(letters),
+        targets=targets,
+    )
 
-    if qd.type == "dropdown":
-        answer = _extract_answer_line(response_text)
-        parts = re.split(r';\s*|\n', answer)
-        values = []
-        for part in parts:
-            part = part.strip()
-            if ":" in part:
-                val = part.split(":", 1)[1].strip()
-                values.append(val)
-            elif part:
-                values.append(part)
-
-        return Action(
-            type="dropdown",
-            answer_text=", ".join(values),
-            targets=qd.input_elements,
-            values=values,
-        )
 
-    # Fallback
+def _parse_fill(response_text: str, qd: QuestionData) -> Action:
+    inputs = qd.input_elements
+    answer = _extract_answer_line(response_text)
+
+    if qd.blank_count > 1:
+        values = [v.strip() for v in answer.split(";") if v.strip()]
+        if len(values) == 1 and len(inputs) > 1:
+            values = [v.strip() for v in answer.split(",") if v.strip()]
+        if len(values) == 1 and len(inputs) > 1:
+            values = [v.strip() for v in answer.split("\n") if v.strip()]
+        # Trim to the inputs before cleaning, then pad missing blanks in one go
+        values = [_NUM_COLON_RE.sub('', v) for v in values[:len(inputs)]]
+        values += [""] * (len(inputs) - len(values))
+    else:
+        values = [answer]
+
+    return Action(
+        type="multi_type",
+        answer_text="; ".join(values),
+        targets=inputs,
+        values=values,
+    )
+
+
+def _parse_dropdown(response_text: str, qd: QuestionData) -> Action:
+    answer = _extract_answer_line(response_text)
+    parts = _SPLIT_SEMI_NL_RE.split(answer)
+    values = []
+    for part in parts:
+        part = part.strip()
+        if ":" in part:
+            val = part.split(":", 1)[1].strip()
+            values.append(val)
+        elif part:
+            values.append(part)
+
+    return Action(
+        type="dropdown",
+        answer_text=", ".join(values),
+        targets=qd.input_elements,
+        values=values,
+    )
+
+
+def _parse_fallback(response_text: str, qd: QuestionData) -> Action:
     answer = _extract_answer_line(response_text)
     return Action(
         type="type",
@@ -338,27 +814,46 @@ def parse_gpt_response(response_text: str, qd: QuestionData) -> Action:
     )
 
 
+_PARSERS = {
+    "ordering": _parse_ordering,
+    "matching": _parse_matching,
+    "mc_single": _parse_mc_single,
+    "mc_multi": _parse_mc_multi,
+    "fill": _parse_fill,
+    "dropdown": _parse_dropdown,
+}
+
+
+def parse_gpt_response(response_text: str, qd: QuestionData) -> Action:
+    """Parse the model's response into an Action."""
+    return _PARSERS.get(qd.type, _parse_fallback)(response_text, qd)
+
+
 # ── Intentional Error Injection ───────────────────────────────────
 
+# Separate generator for which wrong answer to pick; tests can seed it
+_rng = random.Random()
+
+
 def maybe_inject_error(action: Action, qd: QuestionData) -> tuple[Action, bool]:
     """Possibly replace the correct answer with a wrong one to look human."""
     if not human.should_miss():
         return action, False
 
     if qd.type == "mc_single" and len(qd.choices) > 1:
-        correct_letter = action.answer_text
+        correct_letter = action.answer_text.upper()
         wrong_choices = [c for c in qd.choices if c["label"].upper() != correct_letter]
         if wrong_choices:
-            wrong = random.choice(wrong_choices)
+            wrong = _rng.choice(wrong_choices)
             action.answer_text = wrong["label"]
             action.targets = [wrong.get("element")] if wrong.get("element") else []
             logger.info(f"Intentional miss: changed {correct_letter} -> {wrong['label']}")
             return action, True
 
-    elif qd.type == "mc_multi" and len(qd.choices) > 1:
-        if random.random() < 0.5 and len(action.targets) > 1:
-            idx = random.randint(0, len(action.targets) - 1)
-            action.targets.pop(idx)
+    elif qd.type == "mc_multi" and len(action.targets) > 1:
+        # More than one selected target implies more than one choice
+        if _rng.random() < 0.5:
+            action.targets.pop(_rng.randrange(len(action.targets)))
             logger.info("Intentional miss: removed one correct answer from multi-select")
             return action, True
 
@@ -0,0 +1,109 @@
+"""Shared test setup: import path and common fixtures."""
+
+import sys
+import os
+import json
+import asyncio
+
+import pytest
+
+# Add parent directory to path so we can import the modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+from models import QuestionData
+import solver
+import answer_cache
+
+
+@pytest.fixture(scope="module")
+def qd_abcd():
+    """mc_single question shared by the parser tests; parsing must not mutate it."""
+    return QuestionData(
+        type="mc_single",
+        question="Test question",
+        choices=[{"label": c, "text": f"Choice {c}", "element": f"el_{c}"}
+                 for c in "ABCD"],
+    )
+
+
+class FakeResponse:
+    def __init__(self, status_code, body):
+        self.status_code = status_code
+        self._body = body
+        self.content = json.dumps(body).encode()
+
+    def json(self):
+        return self._body
+
+
+class FakeHttp:
+    """requests.Session stand-in: returns queued responses, records posts."""
+
+    def __init__(self):
+        self.responses = []
+        self.calls = 0
+        self.kwargs = []  # keyword arguments of each post
+
+    def reply(self, status_code, body):
+        self.responses.append(FakeResponse(status_code, body))
+
+    def post(self, *args, **kwargs):
+        self.calls += 1
+        self.kwargs.append(kwargs)
+        return self.responses.pop(0)
+
+
+class FakeAsyncHttp:
+    """httpx.AsyncClient stand-in: answers each post with await handler(body)."""
+
+    def __init__(self):
+        self.posts = []
+        self.handler = self._default
+
+    @staticmethod
+    async def _default(content):
+        await asyncio.sleep(0)
+        return "ANSWER: async"
+
+    async def post(self, url, content, headers):
+        self.posts.append(content)
+        return FakeResponse(200, {"answer": await self.handler(content)})
+
+
+@pytest.fixture
+def solver_client(monkeypatch):
+    """solver initialised against a dummy server, answer cache off."""
+    monkeypatch.setattr(solver, "_access_key", "test-key")
+    monkeypatch.setattr(solver, "_server_url", "http://server")
+    monkeypatch.setattr(solver, "_session_start_time", None)
+    monkeypatch.setattr(solver, "_auth_failed_until", 0.0)
+    monkeypatch.setattr(solver, "_auth_error", "")
+    monkeypatch.setattr(solver.time, "sleep", lambda s: None)
+    monkeypatch.setattr(solver.config, "ENABLE_ANSWER_CACHE", False)
+
+
+@pytest.fixture
+def fake_server(monkeypatch, solver_client):
+    """Fake synchronous server; queue replies with fake_server.reply(...)."""
+    http = FakeHttp()
+    monkeypatch.setattr(solver, "_get_http", lambda: http)
+    return http
+
+
+@pytest.fixture
+def fake_async_server(monkeypatch, solver_client):
+    """Fake async server; set fake_async_server.handler to shape its answers."""
+    http = FakeAsyncHttp()
+    monkeypatch.setattr(solver, "_get_async_http", lambda: http)
+    return http
+
+
+@pytest.fixture
+def tmp_answer_cache(monkeypatch, tmp_path, solver_client):
+    """Answer cache enabled on a fresh sqlite file, closed afterwards."""
+    monkeypatch.setattr(solver.config, "ENABLE_ANSWER_CACHE", True)
+    monkeypatch.setattr(solver.config, "ANSWER_CACHE_FILE", str(tmp_path / "cache.sqlite3"))
+    monkeypatch.setattr(answer_cache, "_conn", None)
+    yield
+    if answer_cache._conn is not None:
+        answer_cache._conn.close()
@@ -1,9 +1,8 @@
 """Tests for models.py — dataclass construction and defaults."""
 
 import sys
-import os
 
-sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+import pytest
 
 from models import QuestionData, Action
 
@@ -29,6 +28,13 @@ class TestQuestionData:
         qd1.choices.append({"label": "A"})
         assert len(qd2.choices) == 0
 
+    @pytest.mark.skipif(sys.version_info < (3, 10), reason="dataclass slots need 3.10")
+    def test_slotted(self):
+        qd = QuestionData()
+        assert not hasattr(qd, "__dict__")
+        with pytest.raises(AttributeError):
+            qd.not_a_field = 1
+
 
 class TestAction:
     def test_defaults(self):
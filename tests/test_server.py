@@ -0,0 +1,46 @@
+"""Tests for server/app.py — streamed answer collection."""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(__file__)), "server"))
+
+app = pytest.importorskip("app", reason="server dependencies not installed")
+
+
+class TestCollectText:
+    def test_stops_after_complete_answer_line(self):
+        chunks = ["Thinking...\n", "ANSWER: A, C", "\n", "Extra text\n"]
+        assert app._collect_text(iter(chunks), stop_at_answer=True) == "Thinking...\nANSWER: A, C"
+
+    def test_bare_answer_header_does_not_stop(self):
+        chunks = ["Reasoning\nANSWER:\n", "1. Prophase\n", "2. Metaphase\n"]
+        text = app._collect_text(iter(chunks), stop_at_answer=True)
+        assert text.endswith("2. Metaphase")
+
+    @pytest.mark.parametrize("chunks, tail", [
+        (["Reasoning\nANSWER: 1. Prophase\n", "2. Metaphase\n", "3. Anaphase\n"], "3. Anaphase"),
+        (["Answer: Cell -> Unit\n", "DNA -> Gene\n"], "DNA -> Gene"),
+    ])
+    def test_multi_line_answers_kept_without_stop(self, chunks, tail):
+        assert app._collect_text(iter(chunks), stop_at_answer=False).endswith(tail)
+
+
+class TestRequestChecks:
+    def test_rate_limit_counts_all_or_nothing(self, monkeypatch):
+        monkeypatch.setattr(app, "_rate_tracker", app.defaultdict(list))
+        assert app._consume_rate_limit("k", app.RATE_LIMIT - 2)
+        assert not app._consume_rate_limit("k", 3)
+        assert len(app._rate_tracker["k"]) == app.RATE_LIMIT - 2
+        assert app._consume_rate_limit("k", 2)
+        assert not app._consume_rate_limit("k")
+
+    def test_resolve_model(self):
+        with app.app.app_context():
+            assert app._resolve_model({}, {"plan": "weekly"}) == ("gpt-4o-mini", None)
+            model, denied = app._resolve_model({"model": "gpt-4o"}, {"plan": "weekly"})
+            assert model == "gpt-4o"
+            assert denied[1] == 403
+            assert denied[0].get_json()["allowed_models"] == ["gpt-4o-mini"]
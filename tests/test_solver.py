@@ -1,71 +1,71 @@
 """Tests for solver.py — response parsing and prompt building."""
 
-import sys
-import os
+import copy
+import json
+import asyncio
 
-# Add parent directory to path so we can import the modules
-sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+import pytest
 
 from models import QuestionData, Action
+import solver
+import answer_cache
 from solver import parse_gpt_response, _extract_answer_line, _build_prompt
 
 
 class TestExtractAnswerLine:
-    def test_simple_answer(self):
-        text = "Some reasoning here.\nANSWER: B"
-        assert _extract_answer_line(text) == "B"
-
-    def test_answer_case_insensitive(self):
-        text = "Thinking...\nanswer: C"
-        assert _extract_answer_line(text) == "C"
-
-    def test_answer_with_text(self):
-        text = "Step 1: ...\nStep 2: ...\nANSWER: mitosis"
-        assert _extract_answer_line(text) == "mitosis"
-
-    def test_no_answer_line_returns_last(self):
-        text = "First line\nSecond line\nThe answer is B"
-        assert _extract_answer_line(text) == "The answer is B"
-
-    def test_multi_answer_uses_first(self):
-        text = "ANSWER: wrong\nMore thinking...\nANSWER: correct"
-        assert _extract_answer_line(text) == "wrong"
+    @pytest.mark.parametrize("text, expected", [
+        ("Some reasoning here.\nANSWER: B", "B"),
+        ("Thinking...\nanswer: C", "C"),  # case-insensitive
+        ("Step 1: ...\nStep 2: ...\nANSWER: mitosis", "mitosis"),
+        ("First line\nSecond line\nThe answer is B", "The answer is B"),  # no ANSWER line: last line
+        ("ANSWER: wrong\nMore thinking...\nANSWER: correct", "wrong"),  # first one wins
+        ("Reasoning...\nAnswer:\n  mitosis\n", "mitosis"),  # answer on following line
+        ("The answer: is not A.\nANSWER: D\n", "D"),  # mid-line mention isn't an answer line
+    ])
+    def test_extract(self, text, expected):
+        assert _extract_answer_line(text) == expected
 
 
 class TestParseGptResponseMCSingle:
-    def _make_qd(self, choices):
-        return QuestionData(
-            type="mc_single",
-            question="Test question",
-            choices=[{"label": c, "text": f"Choice {c}", "element": f"el_{c}"}
-                     for c in choices],
-        )
-
-    def test_single_letter(self):
-        qd = self._make_qd(["A", "B", "C"])
-        action = parse_gpt_response("ANSWER: B", qd)
+    def test_single_letter(self, qd_abcd):
+        action = parse_gpt_response("ANSWER: B", qd_abcd)
         assert action.type == "click"
         assert action.answer_text == "B"
         assert action.targets == ["el_B"]
 
-    def test_letter_with_paren(self):
-        qd = self._make_qd(["A", "B", "C"])
-        action = parse_gpt_response("ANSWER: A)", qd)
-        assert action.answer_text == "A"
-
-    def test_chain_of_thought(self):
-        qd = self._make_qd(["A", "B", "C", "D"])
+    @pytest.mark.parametrize("text, expected", [
+        ("B", "B"),  # bare letter reply
+        ("ANSWER: A)", "A"),  # letter with paren
+        ("**B**", "B"),  # markdown-wrapped
+        ("The answer is C.", "C"),  # lead-in before the letter
+    ])
+    def test_letter_forms(self, qd_abcd, text, expected):
+        action = parse_gpt_response(text, qd_abcd)
+        assert action.answer_text == expected
+        assert action.targets == [f"el_{expected}"]
+
+    def test_chain_of_thought(self, qd_abcd):
         text = "The question asks about X.\nOption A is wrong because...\nOption C is correct.\nANSWER: C"
-        action = parse_gpt_response(text, qd)
+        action = parse_gpt_response(text, qd_abcd)
         assert action.answer_text == "C"
         assert action.targets == ["el_C"]
 
-    def test_no_matching_choice(self):
-        qd = self._make_qd(["A", "B"])
-        action = parse_gpt_response("ANSWER: Z", qd)
+    def test_no_matching_choice(self, qd_abcd):
+        action = parse_gpt_response("ANSWER: Z", qd_abcd)
         assert action.answer_text == "Z"
         assert action.targets == []
 
+    def test_truncated_reply_clicks_nothing(self, qd_abcd):
+        action = parse_gpt_response("The answer is", qd_abcd)
+        assert action.answer_text == ""
+        assert action.targets == []
+
+    def test_does_not_mutate_question(self, qd_abcd):
+        original = copy.deepcopy(qd_abcd.choices)
+        parse_gpt_response("ANSWER: B", qd_abcd)
+        parse_gpt_response("ANSWER: Z", qd_abcd)
+        assert qd_abcd.choices == original
+
 
 class TestParseGptResponseMCMulti:
     def test_multi_select(self):
@@ -80,6 +80,16 @@ class TestParseGptResponseMCMulti:
         assert action.answer_text == "A, C"
         assert action.targets == ["el_A", "el_C"]
 
+    def test_lowercase_labels_and_unknown_letter(self):
+        qd = QuestionData(
+            type="mc_multi",
+            question="Test",
+            choices=[{"label": c, "text": f"Choice {c}", "element": f"el_{c}"}
+                     for c in ["a", "b", "c"]],
+        )
+        action = parse_gpt_response("ANSWER: B, Z, A", qd)
+        assert action.targets == ["el_b", "el_a"]
+
 
 class TestParseGptResponseFill:
     def test_single_blank(self):
@@ -145,6 +155,44 @@ class TestParseGptResponseDropdown:
         assert action.values == ["b", "c"]
 
 
+class TestParseGptResponseFallback:
+    def test_unknown_type_types_answer(self):
+        qd = QuestionData(type="essay", question="Explain.", input_elements=["box"])
+        action = parse_gpt_response("Thinking...\nANSWER: because", qd)
+        assert action.type == "type"
+        assert action.values == ["because"]
+        assert action.targets == ["box"]
+
+
+class TestMaybeInjectError:
+    def test_miss_picks_a_wrong_choice_reproducibly(self, monkeypatch):
+        import random
+        monkeypatch.setattr(solver.human, "should_miss", lambda: True)
+        qd = QuestionData(type="mc_single", question="Q?",
+                          choices=[{"label": c, "text": c, "element": f"el_{c}"}
+                                   for c in "ABCD"])
+
+        def miss():
+            action = parse_gpt_response("ANSWER: B", qd)
+            return solver.maybe_inject_error(action, qd)
+
+        monkeypatch.setattr(solver, "_rng", random.Random(7))
+        first, was_miss = miss()
+        assert was_miss
+        assert first.answer_text != "B"
+        assert first.targets == [f"el_{first.answer_text}"]
+
+        monkeypatch.setattr(solver, "_rng", random.Random(7))
+        assert miss()[0].answer_text == first.answer_text
+
+    def test_no_miss_returns_action_unchanged(self, monkeypatch):
+        monkeypatch.setattr(solver.human, "should_miss", lambda: False)
+        qd = QuestionData(type="mc_single", question="Q?",
+                          choices=[{"label": "A", "text": "x"}, {"label": "B", "text": "y"}])
+        action = parse_gpt_response("ANSWER: A", qd)
+        assert solver.maybe_inject_error(action, qd) == (action, False)
+
+
 class TestBuildPrompt:
     def test_mc_single_has_choices(self):
         qd = QuestionData(type="mc_single", question="What is 2+2?",
@@ -153,7 +201,8 @@ class TestBuildPrompt:
         prompt = _build_prompt(qd)
         assert "A) 3" in prompt
         assert "B) 4" in prompt
-        assert "ANSWER:" in prompt
+        assert "ONLY the letter" in prompt
+        assert "step-by-step" not in prompt
 
     def test_context_appears_first(self):
         qd = QuestionData(type="mc_single", question="Test?",
@@ -177,3 +226,226 @@ class TestBuildPrompt:
         assert "- Alpha" in prompt
         assert "- Beta" in prompt
         assert "correct order" in prompt.lower()
+
+    def test_same_type_prompts_share_instruction_prefix(self):
+        q1 = QuestionData(type="mc_single", question="First?", context="Passage one.",
+                          choices=[{"label": "A", "text": "Yes"}])
+        q2 = QuestionData(type="mc_single", question="Second?",
+                          choices=[{"label": "A", "text": "No"}])
+        p1, p2 = _build_prompt(q1), _build_prompt(q2)
+        template = solver._PROMPT_TEMPLATES["mc_single"]
+        assert p1.startswith(template)
+        assert p2.startswith(template)
+        assert "ONLY the letter" in template
+
+    def test_memoized_prompt_tracks_choice_changes(self):
+        qd = QuestionData(type="mc_single", question="Pick one",
+                          choices=[{"label": "A", "text": "Yes"}])
+        first = _build_prompt(qd)
+        assert _build_prompt(qd) is first
+        qd.choices[0]["text"] = "No"
+        assert "A) No" in _build_prompt(qd)
+
+
+class TestBuildPayload:
+    @pytest.mark.parametrize("qd, stop", [
+        (QuestionData(type="mc_multi", question="Q"), True),
+        (QuestionData(type="dropdown", question="Q"), True),
+        (QuestionData(type="fill", question="Q", blank_count=2), True),
+        (QuestionData(type="fill", question="Q"), False),
+        (QuestionData(type="ordering", question="Q", items=["a", "b"]), False),
+        (QuestionData(type="matching", question="Q", sources=["a"], targets=["b"]), False),
+    ])
+    def test_stop_at_answer_only_for_single_line_answers(self, qd, stop):
+        assert solver._build_payload(qd).get("stop_at_answer", False) is stop
+
+
+class TestGetAnswerRetry:
+    def test_retries_transient_5xx(self, fake_server):
+        fake_server.reply(503, {"error": "busy"})
+        fake_server.reply(200, {"answer": "ANSWER: mitosis"})
+        action = solver.get_answer(QuestionData(type="fill", question="Q ___"))
+        assert fake_server.calls == 2
+        assert action.values == ["mitosis"]
+
+    def test_rate_limit_not_retried(self, fake_server):
+        fake_server.reply(429, {})
+        with pytest.raises(RuntimeError):
+            solver.get_answer(QuestionData(type="fill", question="Q ___"))
+        assert fake_server.calls == 1
+
+    def test_403_fails_fast_until_reinit(self, fake_server, monkeypatch):
+        fake_server.reply(403, {"error": "Access key expired"})
+        fake_server.reply(200, {"answer": "ANSWER: ok"})
+        qd = QuestionData(type="fill", question="Q ___")
+        with pytest.raises(PermissionError, match="expired"):
+            solver.get_answer(qd)
+        with pytest.raises(PermissionError, match="expired"):
+            solver.get_answer(qd)
+        assert fake_server.calls == 1
+
+        monkeypatch.setattr(solver, "_auth_failed_until", 0.0)  # as init_client does
+        assert solver.get_answer(qd).values == ["ok"]
+
+
+class TestInitClient:
+    def test_verify_false_skips_health_check(self, solver_client, monkeypatch):
+        def no_network():
+            raise AssertionError("health check should be skipped")
+
+        monkeypatch.setattr(solver, "_get_http", no_network)
+        monkeypatch.setattr(solver, "_access_key", None)
+        solver.init_client("test-key", verify=False)
+        assert solver._access_key == "test-key"
+
+
+class TestAnswerCache:
+    def test_repeat_question_served_from_cache(self, fake_server, tmp_answer_cache):
+        fake_server.reply(200, {"answer": "ANSWER: B"})
+        qd = QuestionData(type="mc_single", question="Cached?",
+                          choices=[{"label": "A", "text": "No", "element": "e1"},
+                                   {"label": "B", "text": "Yes", "element": "e2"}])
+        assert solver.get_answer(qd).answer_text == "B"
+        assert solver.get_answer(qd).answer_text == "B"
+        assert fake_server.calls == 1
+
+    def test_unparseable_reply_not_cached(self, fake_server, tmp_answer_cache):
+        for _ in range(3):
+            fake_server.reply(200, {"answer": "The answer is"})
+        qd = QuestionData(type="mc_single", question="Truncated?",
+                          choices=[{"label": "A", "text": "No", "element": "e1"},
+                                   {"label": "B", "text": "Yes", "element": "e2"}])
+        for _ in range(3):
+            assert solver.get_answer(qd).targets == []
+        assert fake_server.calls == 3
+
+    def test_near_duplicate_wording_hits_cache(self, fake_server, tmp_answer_cache):
+        fake_server.reply(200, {"answer": "ANSWER: A"})
+        fake_server.reply(200, {"answer": "ANSWER: B"})
+        choices = [{"label": "A", "text": "Paris", "element": "e1"},
+                   {"label": "B", "text": "Lyon", "element": "e2"}]
+        qd1 = QuestionData(type="mc_single", question="What is the capital of France?",
+                           choices=list(choices))
+        qd2 = QuestionData(type="mc_single", question="what is the  capital of  France?",
+                           context="A passage.", choices=list(choices))
+        assert solver.get_answer(qd1).answer_text == "A"
+        assert solver.get_answer(qd2).answer_text == "A"
+        assert fake_server.calls == 1
+
+        reordered = QuestionData(type="mc_single", question="What is the capital of France?",
+                                 choices=[{"label": "A", "text": "Lyon", "element": "f1"},
+                                          {"label": "B", "text": "Paris", "element": "f2"}])
+        assert solver.get_answer(reordered).answer_text == "B"
+        assert fake_server.calls == 2
+
+    def test_symbols_keep_questions_apart(self):
+        def key(question, texts, q_type="mc_single"):
+            qd = QuestionData(type=q_type, question=question,
+                              choices=[{"label": l, "text": t} for l, t in zip("AB", texts)])
+            return (answer_cache.make_question_key("m", qd),
+                    answer_cache._variant_key("m", qd))
+
+        plus = key("If x + 3 = 8, what is x?", ["5", "11"])
+        minus = key("If x - 3 = 8, what is x?", ["5", "11"])
+        assert plus[0] != minus[0] and plus[1] != minus[1]
+        assert key("Is 5 > 3?", ["Yes", "No"]) != key("Is 5 < 3?", ["Yes", "No"])
+        assert key("Q", ["5", "7"]) != key("Q", ["-5", "7"])
+        assert key("If  X + 3 = 8, what is x?", ["5", "11"]) == plus
+
+    def test_shuffled_choices_reuse_answer_with_gencache(self, fake_server, tmp_answer_cache,
+                                                         monkeypatch):
+        fake_server.reply(200, {"answer": "ANSWER: A, C"})
+        monkeypatch.setattr(solver.config, "ENABLE_GENCACHE", True)
+        qd1 = QuestionData(type="mc_multi", question="Which are primes?",
+                           choices=[{"label": "A", "text": "2", "element": "e1"},
+                                    {"label": "B", "text": "4", "element": "e2"},
+                                    {"label": "C", "text": "5", "element": "e3"}])
+        qd2 = QuestionData(type="mc_multi", question="Which are primes?",
+                           choices=[{"label": "A", "text": "5", "element": "f1"},
+                                    {"label": "B", "text": "2", "element": "f2"},
+                                    {"label": "C", "text": "4", "element": "f3"}])
+        assert solver.get_answer(qd1).targets == ["e1", "e3"]
+        assert solver.get_answer(qd2).targets == ["f2", "f1"]
+        assert fake_server.calls == 1
+
+
+class TestDirectAnswers:
+    def test_single_option_skips_server(self, fake_server):
+        qd = QuestionData(type="dropdown", question="Fill ___", input_elements=["s1"],
+                          choices=[{"options": ["only"]}])
+        assert solver.get_answer(qd).values == ["only"]
+        assert fake_server.calls == 0
+
+    def test_cloze_from_context_when_enabled(self, fake_server, monkeypatch):
+        monkeypatch.setattr(solver.config, "ENABLE_DIRECT_HEURISTICS", True)
+        qd = QuestionData(type="fill", question="The powerhouse of the cell is the ____.",
+                          context="The powerhouse of the cell is the mitochondrion.")
+        assert solver.get_answer(qd).values == ["mitochondrion"]
+        assert fake_server.calls == 0
+
+
+class TestSolveBatch:
+    def test_results_keep_input_order(self, fake_async_server):
+        async def answer(content):
+            first = b"First" in content
+            await asyncio.sleep(0.01 if first else 0)
+            return "ANSWER: one" if first else "ANSWER: two"
+
+        fake_async_server.handler = answer
+        qs = [QuestionData(type="fill", question="First ___"),
+              QuestionData(type="fill", question="Second ___")]
+        actions = asyncio.run(solver.solve_batch(qs, max_concurrency=2))
+        assert [a.values for a in actions] == [["one"], ["two"]]
+
+    def test_duplicate_questions_share_one_request(self, fake_async_server):
+        async def answer(content):
+            await asyncio.sleep(0.01)
+            return "ANSWER: same"
+
+        fake_async_server.handler = answer
+        qs = [QuestionData(type="fill", question="Dup ___") for _ in range(3)]
+        actions = asyncio.run(solver.solve_batch(qs))
+        assert [a.values for a in actions] == [["same"]] * 3
+        assert len(fake_async_server.posts) == 1
+        assert solver._inflight == {}
+
+
+class TestGetAnswersBatch:
+    def test_one_request_for_several_questions(self, fake_server):
+        fake_server.reply(200, {"answers": ["ANSWER: one", "ANSWER: two"]})
+        qs = [QuestionData(type="fill", question="First ___"),
+              QuestionData(type="dropdown", question="x", choices=[{"options": ["only"]}]),
+              QuestionData(type="fill", question="Second ___")]
+        actions = solver.get_answers_batch(qs)
+        assert [a.values for a in actions] == [["one"], ["only"], ["two"]]
+        assert fake_server.calls == 1
+
+    def test_splits_into_server_sized_groups(self, fake_server):
+        n = solver._SOLVE_MANY_MAX + 2
+        fake_server.reply(200, {"answers": [f"ANSWER: a{i}" for i in range(solver._SOLVE_MANY_MAX)]})
+        fake_server.reply(200, {"answers": ["ANSWER: b0", "ANSWER: b1"]})
+        qs = [QuestionData(type="fill", question=f"Q{i} ___") for i in range(n)]
+        actions = solver.get_answers_batch(qs)
+        assert fake_server.calls == 2
+        assert actions[0].values == ["a0"]
+        assert actions[-1].values == ["b1"]
+
+    def test_falls_back_when_server_lacks_endpoint(self, fake_server, fake_async_server):
+        fake_server.reply(404, {"error": "Not Found"})
+        actions = solver.get_answers_batch([QuestionData(type="fill", question="Q ___")])
+        assert actions[0].values == ["async"]
+
+
+class TestWaitForBatch:
+    def test_polls_with_encoded_body_until_completed(self, fake_server):
+        fake_server.reply(200, {"status": "in_progress"})
+        fake_server.reply(200, {"status": "completed", "answers": {"0": "ANSWER: one"}})
+        qs = [QuestionData(type="fill", question="A ___"),
+              QuestionData(type="fill", question="B ___")]
+        actions = solver.wait_for_batch("batch_1", qs, poll=0)
+        assert actions[0].values == ["one"]
+        assert actions[1] is None
+        assert fake_server.calls == 2
+        sent = fake_server.kwargs[0]
+        assert "json" not in sent
+        assert json.loads(sent["data"]) == {"access_key": "test-key", "batch_id": "batch_1"}
@@ -0,0 +1,85 @@
+"""Tests for updater.py — release lookup caching and version comparison."""
+
+import json
+
+import updater
+
+
+class _FakeResponse:
+    def __init__(self, status_code, body=None, etag=""):
+        self.status_code = status_code
+        self._body = body or {}
+        self.headers = {"ETag": etag} if etag else {}
+        self.content = json.dumps(self._body).encode()
+
+    def json(self):
+        return self._body
+
+
+class TestCheckForUpdate:
+    def _setup(self, monkeypatch, tmp_path, responses):
+        calls = []
+
+        class FakeSession:
+            def get(self, url, timeout, headers):
+                calls.append(headers)
+                return responses.pop(0)
+
+        monkeypatch.setattr(updater.config, "UPDATE_CACHE_FILE", str(tmp_path / "update.json"))
+        monkeypatch.setattr(updater.config, "APP_VERSION", "1.1.1")
+        monkeypatch.setattr(updater, "_get_http", lambda: FakeSession())
+        return calls
+
+    def test_new_release_is_reported(self, monkeypatch, tmp_path):
+        self._setup(monkeypatch, tmp_path, [
+            _FakeResponse(200, {"tag_name": "v1.2.0", "html_url": "https://x/r"}, etag='"a"'),
+        ])
+        assert updater.check_for_update() == ("1.2.0", "https://x/r")
+
+    def test_recent_check_skips_request(self, monkeypatch, tmp_path):
+        calls = self._setup(monkeypatch, tmp_path, [
+            _FakeResponse(200, {"tag_name": "v1.1.1"}, etag='"a"'),
+        ])
+        assert updater.check_for_update() is None
+        assert updater.check_for_update() is None
+        assert len(calls) == 1
+
+    def test_not_modified_reuses_cached_release(self, monkeypatch, tmp_path):
+        calls = self._setup(monkeypatch, tmp_path, [
+            _FakeResponse(200, {"tag_name": "v2.0.0", "html_url": "u"}, etag='"a"'),
+            _FakeResponse(304),
+        ])
+        assert updater.check_for_update() == ("2.0.0", "u")
+        monkeypatch.setattr(updater.config, "UPDATE_CHECK_INTERVAL", 0)
+        assert updater.check_for_update() == ("2.0.0", "u")
+        assert calls[1] == {"If-None-Match": '"a"'}
+
+
+class TestIsNewer:
+    def test_basic_ordering(self):
+        assert updater._is_newer("1.2.0", "1.1.9")
+        assert not updater._is_newer("1.1.9", "1.2.0")
+        assert updater._is_newer("1.10.0", "1.9.0")
+
+    def test_different_lengths(self):
+        assert not updater._is_newer("1.2", "1.2.0")
+        assert updater._is_newer("1.2.0.1", "1.2.0")
+
+    def test_prerelease_is_older_than_release(self):
+        assert not updater._is_newer("1.2.0rc1", "1.2.0")
+        assert updater._is_newer("1.2.0", "1.2.0rc1")
+
+    def test_garbage_is_not_newer(self):
+        assert not updater._is_newer("latest", "1.0.0")
+        assert not updater._is_newer(None, "1.0.0")
+
+    def test_numeric_fallback_without_packaging(self, monkeypatch):
+        monkeypatch.setattr(updater, "Version", None)
+        updater._parse_version.cache_clear()
+        try:
+            assert updater._is_newer("1.10.0", "1.9.0")
+            assert not updater._is_newer("1.2", "1.2.0")
+            assert updater._is_newer("1.2.0.1", "1.2.0")
+            assert not updater._is_newer("1.2.0rc1", "1.1.0")
+        finally:
+            updater._parse_version.cache_clear()
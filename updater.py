@@ -1,10 +1,98 @@
 """Check GitHub Releases for app updates."""
+import os
+import json
+import time
 import logging
+from functools import lru_cache
+
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+try:
+    from packaging.version import Version
+except ImportError:  # plain numeric versions only, see _parse_version
+    Version = None
+
+try:
+    import orjson  # optional, same as solver
+except ImportError:
+    orjson = None
+
 import config
 
 log = logging.getLogger(__name__)
 
+_http = None
+
+
+def _get_http():
+    """Return the shared GitHub session (kept alive between checks)."""
+    global _http
+    if _http is None:
+        _http = requests.Session()
+        _http.headers["Accept"] = "application/vnd.github+json"
+        _http.mount("https://", HTTPAdapter(
+            pool_connections=1, pool_maxsize=1,
+            # Runs on a background thread, so waiting out a Retry-After is fine
+            max_retries=Retry(total=3, backoff_factor=0.3,
+                              status_forcelist=[429, 500, 502, 503, 504],
+                              respect_retry_after_header=True, raise_on_status=False),
+        ))
+    return _http
+
+
+def _cache_path():
+    return os.path.join(config._get_app_dir(), config.UPDATE_CACHE_FILE)
+
+
+def _load_cache():
+    """Last release lookup: {etag, tag_name, html_url, checked_at}, or {}."""
+    try:
+        with open(_cache_path(), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_cache(cache):
+    try:
+        with open(_cache_path(), "w", encoding="utf-8") as f:
+            json.dump(cache, f)
+    except OSError:
+        log.debug("Could not write update cache", exc_info=True)
+
+
+def _latest_release():
+    """Return the cached or freshly fetched release info, or None.
+
+    Within UPDATE_CHECK_INTERVAL of the last check the cache is used as-is.
+    After that GitHub is asked with If-None-Match; a 304 costs no body and
+    doesn't count against the API rate limit.
+    """
+    cache = _load_cache()
+    if cache and time.time() - cache.get("checked_at", 0) < config.UPDATE_CHECK_INTERVAL:
+        return cache
+
+    url = f"https://api.github.com/repos/{config.GITHUB_REPO}/releases/latest"
+    headers = {"If-None-Match": cache["etag"]} if cache.get("etag") else {}
+    resp = _get_http().get(url, timeout=5, headers=headers)
+    if resp.status_code == 304 and cache:
+        release = cache
+    elif resp.status_code == 200:
+        data = orjson.loads(resp.content) if orjson is not None else resp.json()
+        release = {
+            "etag": resp.headers.get("ETag", ""),
+            "tag_name": data.get("tag_name", ""),
+            "html_url": data.get("html_url", ""),
+        }
+    else:
+        return None
+
+    release["checked_at"] = time.time()
+    _save_cache(release)
+    return release
+
 
 def check_for_update():
     """Check if a newer version is available on GitHub Releases.
@@ -13,18 +101,16 @@ def check_for_update():
     Silently returns None on any error (no internet, API down, etc.).
     """
     try:
-        url = f"https://api.github.com/repos/{config.GITHUB_REPO}/releases/latest"
-        resp = requests.get(url, timeout=5)
-        if resp.status_code != 200:
+        release = _latest_release()
+        if not release:
             return None
 
-        data = resp.json()
-        latest = data.get("tag_name", "").lstrip("vV")
+        latest = release.get("tag_name", "").lstrip("vV")
         if not latest:
             return None
 
         if _is_newer(latest, config.APP_VERSION):
-            download_url = data.get("html_url", "")
+            download_url = release.get("html_url", "")
             return latest, download_url
 
     except Exception:
@@ -33,11 +119,25 @@ def check_for_update():
     return None
 
 
+@lru_cache(maxsize=8)
+def _parse_version(text):
+    if Version is not None:
+        return Version(text)
+    # Without packaging: "1.2" -> (1, 2, 0), so it compares equal to "1.2.0"
+    parts = [int(x) for x in text.split(".")]
+    return tuple(parts + [0] * (3 - len(parts)))
+
+
 def _is_newer(remote, local):
-    """Compare semver strings. Returns True if remote > local."""
+    """Compare PEP 440 version strings. Returns True if remote > local.
+
+    Handles differing lengths (1.2 == 1.2.0) and pre-releases
+    (1.2.0rc1 < 1.2.0). Parsed versions are cached, so the local version is
+    only parsed once.
+    """
+    if remote == local:  # the usual "already up to date" case
+        return False
     try:
-        remote_parts = [int(x) for x in remote.split(".")]
-        local_parts = [int(x) for x in local.split(".")]
-        return remote_parts > local_parts
-    except (ValueError, AttributeError):
+        return _parse_version(remote) > _parse_version(local)
+    except (ValueError, TypeError):  # InvalidVersion is a ValueError
         return False